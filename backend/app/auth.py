@@ -0,0 +1,127 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import asyncio
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+
+# --- AUTH CONFIG (overridable from .env) ---
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 2))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "64"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+
+# Local development only: lets the API start without a configured SESSION_SECRET
+DEV_MODE = os.getenv("DEEPBLUE_DEV", "0") == "1"
+
+# Every API worker must share this secret for tokens to be accepted across workers and restarts
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+if not SESSION_SECRET:
+    if not DEV_MODE:
+        raise RuntimeError(
+            "SESSION_SECRET is not set. Put a long random string in backend/.env "
+            "(or set DEEPBLUE_DEV=1 for a throwaway one in local development)."
+        )
+    print("⚠️ SESSION_SECRET not set (DEEPBLUE_DEV=1); session tokens will not survive a restart.")
+    SESSION_SECRET = secrets.token_hex(32)
+
+# Password Hashing Config
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class AuthBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+
+
+# --- PASSWORD HASHING (runs in the hasher processes) ---
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+
+class PasswordHasher:
+    """
+    bcrypt on a dedicated process pool, so login storms use every core
+    without filling the API's threadpool. Excess work is rejected with AuthBusy.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_queue=HASH_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.max_pending = self.workers + max_queue
+        self.pending = 0
+        self._pool = None
+
+    def _submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise AuthBusy("Too many logins in progress. Please retry in a moment.")
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def _run(self, fn, *args):
+        future = self._submit(fn, *args)
+        self.pending += 1
+        try:
+            return await future
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, password, hashed_password):
+        return await self._run(verify_password, password, hashed_password)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher()
+
+
+# --- SESSION TOKENS ---
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(SESSION_SECRET.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).digest())
+
+def create_session_token(user_id: int, username: str) -> str:
+    """HMAC-signed `<payload>.<signature>` token carrying the user id and an expiry."""
+    payload = _b64encode(json.dumps(
+        {"uid": user_id, "sub": username, "exp": int(time.time()) + SESSION_TTL},
+        separators=(",", ":"),
+    ).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+def decode_session_token(token: str):
+    """Returns the token's claims, or None if it is malformed, forged or expired."""
+    try:
+        payload, signature = token.split(".", 1)
+        if not hmac.compare_digest(signature.encode("utf-8"), _sign(payload).encode("ascii")):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+        return None
+    return claims
+
+def bearer_claims(authorization: str):
+    """Claims from an `Authorization: Bearer <token>` header, or None."""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    return decode_session_token(authorization[7:].strip())
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import threading
+import time
+
+MISSIONS_PATH = os.path.join(os.path.dirname(__file__), "data", "missions.json")
+
+# How often (seconds) we are allowed to stat() the file to look for edits
+STAT_INTERVAL = 1.0
+
+
+class MissionCatalog:
+    """
+    In-memory view of missions.json.
+    Parsed once, indexed by id, and re-read only when the file's mtime changes.
+    """
+
+    def __init__(self, path: str = MISSIONS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._last_check = 0.0
+
+        self._by_id = {}
+        self._listings = {True: [], False: []}
+        # Pre-rendered /missions bodies + ETags, one per tier (premium / free)
+        self._rendered = {True: (b"[]", '"empty"'), False: (b"[]", '"empty"')}
+
+        self.reload()
+
+    # --- LOADING ---
+
+    def _flatten(self, data):
+        """Yields (category, mission) pairs for both the dict and list file layouts."""
+        if isinstance(data, dict):
+            for category, items in data.items():
+                if not isinstance(items, list):
+                    continue
+                for m in items:
+                    if isinstance(m, dict):
+                        yield category, m
+        elif isinstance(data, list):
+            for m in data:
+                if isinstance(m, dict):
+                    yield None, m
+
+    def reload(self):
+        """Re-parses the file and swaps in the new indexes atomically."""
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Error loading missions: {e}")
+                return False
+
+            by_id = {}
+            listing = []
+            for category, mission in self._flatten(data):
+                # First definition wins, same as the old linear scan
+                if mission.get("id") is not None:
+                    by_id.setdefault(mission["id"], mission)
+
+                # Listing entries are copies, so the tag never leaks into the index
+                entry = dict(mission)
+                if category is not None:
+                    entry["category_tag"] = category
+                listing.append(entry)
+
+            listings = {
+                True: listing,
+                False: [m for m in listing if m.get("difficulty") == "Easy"],
+            }
+            rendered = {}
+            for tier, items in listings.items():
+                body = json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                rendered[tier] = (body, '"' + hashlib.sha1(body).hexdigest() + '"')
+
+            self._by_id = by_id
+            self._listings = listings
+            self._rendered = rendered
+            self._mtime = mtime
+            self._last_check = time.monotonic()
+            return True
+
+    def _refresh_if_stale(self):
+        now = time.monotonic()
+        if now - self._last_check < STAT_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    # --- LOOKUPS ---
+
+    def get(self, mission_id):
+        """Returns the mission dict for an id, or None. Callers must not mutate it."""
+        self._refresh_if_stale()
+        return self._by_id.get(mission_id)
+
+    def list(self, is_premium: bool = False):
+        self._refresh_if_stale()
+        return self._listings[bool(is_premium)]
+
+    def rendered(self, is_premium: bool = False):
+        """Returns (json_body_bytes, etag) for the /missions listing of a tier."""
+        self._refresh_if_stale()
+        return self._rendered[bool(is_premium)]
+
+
+mission_catalog = MissionCatalog()
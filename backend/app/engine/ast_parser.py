@@ -1,117 +1,229 @@
+import os
 import ast
-import json
+import hashlib
+import threading
+from collections import OrderedDict, deque
 
-class CodeTo3DVisitor(ast.NodeVisitor):
-    def __init__(self):
+from app.metrics import stage, count_lookup
+
+# Stable IDs are truncated to 53 bits so they stay exact as JavaScript numbers
+STABLE_ID_MASK = (1 << 53) - 1
+ROOT_ID = 0
+
+# Level of detail: past this many nodes, subtrees are collapsed into aggregate nodes
+LOD_NODE_BUDGET = int(os.getenv("LOD_NODE_BUDGET", "400"))
+# Upper bound on what a client may ask for via max_nodes
+LOD_MAX_NODES = int(os.getenv("LOD_MAX_NODES", "5000"))
+
+# Recent parse results, keyed by a hash of the source (+ LOD options)
+PARSE_CACHE_SIZE = 256
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+def _stable_id(parent_id, key, ordinal):
+    """
+    ID from structural position (parent + n-th sibling of this kind) and content (key).
+    Editing one part of the program leaves IDs elsewhere untouched.
+    """
+    digest = hashlib.blake2b(f"{parent_id}|{key}|{ordinal}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") & STABLE_ID_MASK
+
+# --- Node Descriptions: ast node -> (label, type, key) ---
+
+def _describe_function(node):
+    return f"Func: {node.name}", "function", f"function:{node.name}"
+
+def _describe_for(node):
+    target = node.target.id if isinstance(node.target, ast.Name) else "iterator"
+    return f"Loop: For {target}", "loop", f"loop:{target}"
+
+def _describe_if(node):
+    # We can try to extract the first part of the condition for a better label
+    test_label = ast.dump(node.test, indent=None).split('\n')[0]
+    # The condition is left out of the key, so editing it shows up as a changed label
+    return f"Decision: If ({test_label[:20]}...)", "decision", "decision"
+
+def _describe_assign(node):
+    # Handles variable assignments: e.g., 'x = 10'
+    target_name = node.targets[0].id if hasattr(node.targets[0], 'id') else 'Assignment'
+    return f"Assign: {target_name}", "statement", f"statement:{target_name}"
+
+def _describe_call(node):
+    # Handles function calls: e.g., 'print()', 'list.pop()'
+    func_name = ""
+    if isinstance(node.func, ast.Name):
+        func_name = node.func.id
+    elif isinstance(node.func, ast.Attribute):
+        # Handles method calls: list.pop, str.lower
+        if hasattr(node.func.value, 'id'):
+            object_name = node.func.value.id
+        else:
+            object_name = 'Object'
+        func_name = f"{object_name}.{node.func.attr}"
+    return f"Call: {func_name}", "operation", f"operation:{func_name}"
+
+# Containers become parents of the nodes inside them; the rest are leaves
+# (anything nested in an Assign/Call still hangs off the enclosing container).
+CONTAINERS = {
+    ast.FunctionDef: _describe_function,
+    ast.For: _describe_for,
+    ast.If: _describe_if,
+}
+LEAVES = {
+    ast.Assign: _describe_assign,
+    ast.Call: _describe_call,
+}
+
+def _count_statements(node):
+    return sum(1 for n in ast.walk(node) if isinstance(n, ast.stmt)) - 1
+
+def _graph_children(container):
+    """AST nodes that become direct graph children of `container`, in source order."""
+    children = []
+    stack = list(reversed(list(ast.iter_child_nodes(container))))
+    while stack:
+        node = stack.pop()
+        node_type = type(node)
+        if node_type in CONTAINERS:
+            children.append(node)
+            continue
+        if node_type in LEAVES:
+            children.append(node)
+        stack.extend(reversed(list(ast.iter_child_nodes(node))))
+    return children
+
+class CodeTo3DGraph:
+    """
+    Builds the visual graph breadth-first with an explicit queue (no recursion),
+    so the top of the program is always shown and huge inputs stay within `max_nodes`.
+    Containers that don't fit are collapsed into aggregate nodes; IDs listed in
+    `expand` are opened regardless of the budget.
+    """
+
+    def __init__(self, max_nodes=None, expand=()):
+        self.max_nodes = max_nodes
+        self.expand = set(expand)
         self.nodes = []
         self.links = []
-        self.parent_stack = [] 
-        self.node_counter = 0
+        # (parent_id, key) -> how many siblings with that key we've seen
+        self.sibling_counts = {}
 
-    def _add_node(self, label, type_name):
-        # Assign a unique integer ID for easier linking
-        node_id = self.node_counter 
-        self.nodes.append({
+    def _add_node(self, parent_id, label, type_name, key):
+        ordinal = self.sibling_counts.get((parent_id, key), 0)
+        self.sibling_counts[(parent_id, key)] = ordinal + 1
+
+        node_id = _stable_id(parent_id, key, ordinal)
+        node = {
             "id": node_id,
             "label": label,
             "type": type_name,
             "group": 1 if type_name == "function" else 2 # Grouping helps with visual clustering
-        })
-        self.node_counter += 1
-        return node_id
+        }
+        self.nodes.append(node)
+        if parent_id != ROOT_ID:
+            self._add_link(parent_id, node_id)
+        return node
 
     def _add_link(self, source_id, target_id):
-        # Ensure the link uses integer IDs
-        self.links.append({
-            "source": int(source_id),
-            "target": int(target_id)
-        })
-
-    def generic_visit(self, node):
-        super().generic_visit(node)
-
-    # --- Core Structure Nodes ---
-
-    def visit_FunctionDef(self, node):
-        node_id = self._add_node(f"Func: {node.name}", "function")
-        if self.parent_stack:
-            self._add_link(self.parent_stack[-1], node_id)
-        self.parent_stack.append(node_id)
-        self.generic_visit(node)
-        self.parent_stack.pop()
-        
-    # --- Control Flow Nodes ---
-
-    def visit_For(self, node):
-        target = node.target.id if isinstance(node.target, ast.Name) else "iterator"
-        node_id = self._add_node(f"Loop: For {target}", "loop")
-        if self.parent_stack:
-            self._add_link(self.parent_stack[-1], node_id)
-        self.parent_stack.append(node_id)
-        self.generic_visit(node)
-        self.parent_stack.pop()
-
-    def visit_If(self, node):
-        # We can try to extract the first part of the condition for a better label
-        test_label = ast.dump(node.test, indent=None).split('\n')[0]
-        node_id = self._add_node(f"Decision: If ({test_label[:20]}...)", "decision")
-        if self.parent_stack:
-            self._add_link(self.parent_stack[-1], node_id)
-        self.parent_stack.append(node_id)
-        self.generic_visit(node)
-        self.parent_stack.pop()
-
-    # --- Data/Operation Nodes (NEW) ---
-
-    def visit_Assign(self, node):
-        # Handles variable assignments: e.g., 'x = 10'
-        # Get the target variable name (handles simple assignment)
-        target_name = node.targets[0].id if hasattr(node.targets[0], 'id') else 'Assignment'
-        node_id = self._add_node(f"Assign: {target_name}", "statement")
-        if self.parent_stack:
-            self._add_link(self.parent_stack[-1], node_id)
-        
-        # We don't push 'Assign' to parent_stack because subsequent nodes usually aren't nested within the assignment itself
-        self.generic_visit(node)
-
-    def visit_Call(self, node):
-        # Handles function calls: e.g., 'print()', 'list.pop()'
-        func_name = ""
-        if isinstance(node.func, ast.Name):
-            func_name = node.func.id
-        elif isinstance(node.func, ast.Attribute):
-            # Handles method calls: list.pop, str.lower
-            if hasattr(node.func.value, 'id'):
-                object_name = node.func.value.id
-            else:
-                object_name = 'Object'
-            func_name = f"{object_name}.{node.func.attr}"
-            
-        node_id = self._add_node(f"Call: {func_name}", "operation")
-        if self.parent_stack:
-            self._add_link(self.parent_stack[-1], node_id)
-        
-        self.generic_visit(node)
-
-def parse_code_to_3d(code_string):
+        self.links.append({"source": source_id, "target": target_id})
+
+    def _collapse(self, node, ast_node):
+        hidden = _count_statements(ast_node)
+        node["label"] = f"{node['label']} ({hidden} statements)"
+        node["collapsed"] = True
+        node["hidden"] = hidden
+
+    def _add_more(self, parent_id, page, hidden):
+        # Overflow marker after the visible children; its ID encodes which page it hides
+        self.sibling_counts[(parent_id, "more")] = page
+        node = self._add_node(parent_id, f"… {hidden} more", "statement", "more")
+        node["collapsed"] = True
+        node["hidden"] = hidden
+
+    def _page(self, children, parent_id):
+        """
+        Splits children into (shown, overflow) in pages of `max_nodes`.
+        Each page past the first sits behind a "more" node that can itself be expanded.
+        """
+        if self.max_nodes is None:
+            return children, None
+
+        page_size = max(1, self.max_nodes)
+        page = 0
+        while True:
+            end = (page + 1) * page_size
+            if end >= len(children):
+                return children, None
+            if _stable_id(parent_id, "more", page) not in self.expand:
+                return children[:end], (page, len(children) - end)
+            page += 1
+
+    def build(self, tree):
+        pending = deque([(tree, ROOT_ID, None)])
+        while pending:
+            ast_node, graph_id, graph_node = pending.popleft()
+            children = _graph_children(ast_node)
+
+            forced = graph_id == ROOT_ID or graph_id in self.expand
+            over_budget = (
+                self.max_nodes is not None
+                and len(self.nodes) + len(children) > self.max_nodes
+            )
+            if over_budget and not forced:
+                self._collapse(graph_node, ast_node)
+                continue
+
+            shown, overflow = self._page(children, graph_id)
+            for child in shown:
+                describe = CONTAINERS.get(type(child)) or LEAVES[type(child)]
+                node = self._add_node(graph_id, *describe(child))
+                if type(child) in CONTAINERS:
+                    pending.append((child, node["id"], node))
+            if overflow:
+                self._add_more(graph_id, *overflow)
+
+def parse_code_to_3d(code_string, max_nodes=None, expand=(), tree=None):
     """
     Parses Python code into an AST and converts it into a network graph structure.
+    `max_nodes` turns on level-of-detail collapsing; `expand` lists node IDs to open.
+    `tree` is an optional, already parsed AST of `code_string`.
+    Results are cached; treat the returned dict as read-only.
     """
+    expand = tuple(sorted(set(expand or ())))
+    cache_key = (hashlib.sha1(code_string.encode("utf-8")).hexdigest(), max_nodes, expand)
+    with _parse_cache_lock:
+        cached = _parse_cache.get(cache_key)
+        if cached is not None:
+            _parse_cache.move_to_end(cache_key)
+    count_lookup("parse", cached is not None)
+    if cached is not None:
+        return cached
+
+    with stage("ast.parse"):
+        graph = _build_graph(code_string, max_nodes, expand, tree)
+
+    with _parse_cache_lock:
+        _parse_cache[cache_key] = graph
+        while len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return graph
+
+def _build_graph(code_string, max_nodes=None, expand=(), tree=None):
     try:
         # Prevent parsing empty code to avoid unnecessary errors
         if not code_string.strip():
              return {"error": "Code input is empty.", "nodes": [], "links": []}
-             
-        tree = ast.parse(code_string)
-        visitor = CodeTo3DVisitor()
-        visitor.visit(tree)
-        
-        # Use integer IDs as numbers for strict JSON formatting
-        final_nodes = [{k: int(v) if k == 'id' else v for k, v in node.items()} for node in visitor.nodes]
-        final_links = [{k: int(v) if isinstance(v, str) and v.isdigit() else v for k, v in link.items()} for link in visitor.links]
-        
-        return {"nodes": final_nodes, "links": final_links}
+
+        if tree is None:
+            tree = ast.parse(code_string)
+        builder = CodeTo3DGraph(max_nodes=max_nodes, expand=expand)
+        builder.build(tree)
+
+        # IDs are already ints, so the builder's lists go out as-is
+        return {"nodes": builder.nodes, "links": builder.links}
     except SyntaxError as e:
         return {"error": f"Syntax Error: {e.msg} at line {e.lineno}", "nodes": [], "links": []}
+    except (RecursionError, MemoryError):
+        return {"error": "Code is nested too deeply to visualize.", "nodes": [], "links": []}
     except Exception as e:
-        return {"error": str(e), "nodes": [], "links": []}
\ No newline at end of file
+        return {"error": str(e), "nodes": [], "links": []}
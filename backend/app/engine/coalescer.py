@@ -0,0 +1,118 @@
+import asyncio
+import contextlib
+
+from app.metrics import TUTOR_COALESCED
+
+
+class Superseded(Exception):
+    """Raised to callers whose request was replaced by a newer one for the same session."""
+
+
+class _Flight:
+    """The one tutor call (or stream) currently running for a session."""
+
+    def __init__(self, key):
+        self.key = key
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+
+    def supersede(self):
+        if self.future.done():
+            return False
+        self.future.set_exception(Superseded())
+        self.future.exception()  # retrieved here, so no warning when nobody is waiting
+        if self.task is not None:
+            self.task.cancel()
+        return True
+
+
+class SessionCoalescer:
+    """
+    At most one tutor call per session.
+    A request identical to the one in flight (same key) shares its result;
+    a different one cancels it, whether it is still queued for an LLM slot or
+    streaming, and its callers get Superseded. Only the latest code is analyzed.
+    """
+
+    def __init__(self):
+        self._flights = {}  # session_id -> _Flight
+
+    def _replace(self, session_id, flight):
+        previous = self._flights.get(session_id)
+        if previous is not None and previous.supersede():
+            TUTOR_COALESCED.inc(outcome="superseded")
+        self._flights[session_id] = flight
+
+    def _release(self, session_id, flight):
+        if self._flights.get(session_id) is flight:
+            del self._flights[session_id]
+
+    async def run(self, session_id, key, make_call, supersede=True):
+        """
+        Awaits make_call() for this session, or joins an identical call already in flight.
+        With supersede=False (shared sessions) other in-flight calls are left alone.
+        """
+        flight = self._flights.get(session_id)
+        if flight is not None and flight.key == key and not flight.future.done():
+            TUTOR_COALESCED.inc(outcome="joined")
+        elif not supersede:
+            return await make_call()
+        else:
+            flight = _Flight(key)
+            self._replace(session_id, flight)
+            flight.task = asyncio.ensure_future(self._fly(session_id, flight, make_call))
+        # Shielded: one caller disconnecting must not cancel the call for the others
+        return await asyncio.shield(flight.future)
+
+    async def _fly(self, session_id, flight, make_call):
+        try:
+            result = await make_call()
+        except asyncio.CancelledError:
+            if not flight.future.done():
+                flight.future.cancel()
+            raise
+        except Exception as e:
+            if not flight.future.done():
+                flight.future.set_exception(e)
+        else:
+            if not flight.future.done():
+                flight.future.set_result(result)
+        finally:
+            self._release(session_id, flight)
+
+    async def stream(self, session_id, chunks, supersede=True):
+        """
+        Re-yields an async iterator of chunks until a newer request for the session
+        supersedes it; then the iterator is closed and Superseded is raised.
+        """
+        if not supersede:
+            async for chunk in chunks:
+                yield chunk
+            return
+
+        flight = _Flight(None)  # never joined: streams aren't shared
+        self._replace(session_id, flight)
+        iterator = chunks.__aiter__()
+        try:
+            while True:
+                step = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({step, flight.future}, return_when=asyncio.FIRST_COMPLETED)
+                if flight.future.done() and not step.done():
+                    step.cancel()
+                    with contextlib.suppress(BaseException):
+                        await step
+                    raise Superseded()
+                try:
+                    chunk = step.result()
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            self._release(session_id, flight)
+            if not flight.future.done():
+                flight.future.set_result(None)
+            with contextlib.suppress(Exception):
+                await iterator.aclose()
+
+
+tutor_coalescer = SessionCoalescer()
@@ -1,36 +1,773 @@
-import sys
+import os
 import io
+import sys
+import ast
+import math
+import time
+import queue
+import types
+import signal
+import marshal
+import asyncio
+import builtins
+import threading
 import contextlib
 import traceback
+import contextvars
 import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# POSIX only; without it the sandbox falls back to time limits alone
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from app.metrics import (
+    registry, stage, record_stage, count_lookup, SANDBOX_EVENTS, SANDBOX_CPU_SECONDS, SANDBOX_PEAK_RSS_BYTES,
+)
+from app.engine.preflight import preflight, PreflightError, source_hash, ALLOWED_MODULES, NESTING_MESSAGE
+
+# --- POOL CONFIG (overridable from .env) ---
+POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", os.cpu_count() or 2))
+MAX_RUNS_PER_WORKER = int(os.getenv("SANDBOX_MAX_RUNS_PER_WORKER", "100"))
+MAX_QUEUE = int(os.getenv("SANDBOX_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT = float(os.getenv("SANDBOX_QUEUE_TIMEOUT", "5.0"))
+
+# --- GRADING BUDGETS ---
+CASE_TIMEOUT = float(os.getenv("GRADING_CASE_TIMEOUT", "1.0"))
+TOTAL_TIMEOUT = float(os.getenv("GRADING_TOTAL_TIMEOUT", "5.0"))
+# Extra time the API gives a worker past its own budget before killing it
+KILL_GRACE = 0.5
+
+# --- RESOURCE QUOTAS (per execution, enforced inside the worker) ---
+CPU_LIMIT = float(os.getenv("SANDBOX_CPU_LIMIT", str(TOTAL_TIMEOUT)))
+MEMORY_LIMIT_MB = int(os.getenv("SANDBOX_MEMORY_LIMIT_MB", "256"))
+MAX_RECURSION = int(os.getenv("SANDBOX_MAX_RECURSION", "1000"))
+# Sandboxes run at a lower CPU priority than the API, so a busy box still answers requests
+WORKER_NICE = int(os.getenv("SANDBOX_NICE", "5"))
+
+# --- OUTPUT LIMITS ---
+OUTPUT_MAX_BYTES = int(os.getenv("SANDBOX_OUTPUT_MAX_BYTES", "65536"))
+OUTPUT_MAX_LINES = int(os.getenv("SANDBOX_OUTPUT_MAX_LINES", "2000"))
+# Output reaches the API at the end of every line; a long line without one goes out in
+# chunks of about this size, or at least this often (seconds) while it keeps growing
+OUTPUT_CHUNK_BYTES = 4096
+OUTPUT_FLUSH_INTERVAL = 0.1
+
+TIMEOUT_MESSAGE = "⏱️ Time Limit Exceeded: Check for infinite loops!"
+MEMORY_MESSAGE = "💾 Memory Limit Exceeded: your program used more than {} MB."
+CASE_MEMORY_MESSAGE = "💾 Memory Limit Exceeded"
+CPU_MESSAGE = "⏱️ CPU Limit Exceeded: your program used more than {:.1f}s of CPU time."
+CLIPPED_MARKER = " ✂️ (truncated)"
+
+# Compiled submissions by source hash; re-runs and re-submits skip compile()
+COMPILE_CACHE_SIZE = int(os.getenv("SANDBOX_COMPILE_CACHE_SIZE", "512"))
+_compile_cache = OrderedDict()
+_compile_cache_lock = threading.Lock()
+CRASH_MESSAGE = "💥 Sandbox crashed while running your code."
+
+SAFE_BUILTIN_NAMES = [
+    "print", "range", "len", "int", "float", "str", "list", "dict", "set", "bool",
+    "abs", "round", "min", "max", "sum", "tuple", "frozenset", "enumerate", "zip",
+    "map", "filter", "sorted", "reversed", "any", "all", "isinstance", "issubclass",
+    "pow", "divmod", "chr", "ord", "hex", "bin", "oct", "hash", "iter", "next",
+    "slice", "repr", "format", "type", "object", "super", "property", "staticmethod",
+    "classmethod", "callable", "getattr", "hasattr", "setattr", "id", "complex",
+    "bytes", "bytearray", "NotImplemented", "Ellipsis", "None", "True", "False",
+    "Exception", "ValueError", "TypeError", "KeyError", "IndexError", "ZeroDivisionError",
+    "AttributeError", "RuntimeError", "StopIteration", "NotImplementedError",
+    "ArithmeticError", "AssertionError", "LookupError", "OverflowError", "RecursionError",
+    "ImportError", "NameError",
+]
+
+
+class SandboxBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class _BudgetExceeded(BaseException):
+    """Raised inside the worker by SIGALRM/SIGXCPU. BaseException so student `except Exception` can't swallow it."""
+
+
+# --- JOB CONSTRUCTION (API PROCESS) ---
+
+def build_job(code, test_cases=None, entry=None, case_timeout=CASE_TIMEOUT,
+              total_timeout=TOTAL_TIMEOUT, fail_fast=False,
+              max_output_bytes=OUTPUT_MAX_BYTES, max_output_lines=OUTPUT_MAX_LINES,
+              cpu_limit=CPU_LIMIT, memory_limit_mb=MEMORY_LIMIT_MB, max_recursion=MAX_RECURSION,
+              tree=None):
+    """
+    Compiles a submission (once per distinct source; see _compile_cached), ready to ship to a worker.
+    Pass `tree` to reuse an AST that was already parsed from `code`.
+    Raises SyntaxError, or PreflightError for code too deeply nested to compile,
+    before any sandbox is involved.
+    """
+    compiled, defined = _compile_cached(code, tree)
+
+    # Grade the requested function if the student defined it, else their first top-level def
+    if entry not in defined:
+        entry = defined[0] if defined else None
+
+    return {
+        "compiled": compiled,
+        "entry": entry,
+        "test_cases": test_cases,
+        "case_timeout": case_timeout,
+        "total_timeout": total_timeout,
+        "fail_fast": fail_fast,
+        "max_output_bytes": max_output_bytes,
+        "max_output_lines": max_output_lines,
+        "cpu_limit": cpu_limit,
+        "memory_limit_mb": memory_limit_mb,
+        "max_recursion": max_recursion,
+    }
+
+
+def _compile_cached(code, tree=None):
+    """(marshalled code object, top-level function names), compiled at most once per source."""
+    key = source_hash(code)
+    with _compile_cache_lock:
+        cached = _compile_cache.get(key)
+        if cached is not None:
+            _compile_cache.move_to_end(key)
+    count_lookup("compile", cached is not None)
+    if cached is not None:
+        return cached
+
+    with stage("sandbox.compile"):
+        if tree is None:
+            tree = ast.parse(code, "<string>")
+        try:
+            compiled = marshal.dumps(compile(tree, "<string>", "exec"))
+        except (RecursionError, MemoryError):
+            # The parser accepts somewhat deeper code than the compiler does
+            raise PreflightError(NESTING_MESSAGE, "syntax")
+        defined = tuple(n.name for n in tree.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef)))
+
+    with _compile_cache_lock:
+        _compile_cache[key] = (compiled, defined)
+        while len(_compile_cache) > COMPILE_CACHE_SIZE:
+            _compile_cache.popitem(last=False)
+    return compiled, defined
+
+
+# --- INSIDE THE WORKER PROCESS ---
+
+# Classes reachable from allowed modules, with their attributes as first seen; restored after
+# every job so one submission can't monkeypatch e.g. collections.Counter for the next one
+_class_snapshots = {}  # id(cls) -> (cls, attributes)
+
+
+def _remember_class(cls):
+    if cls.__module__ != "builtins" and id(cls) not in _class_snapshots:
+        _class_snapshots[id(cls)] = (cls, dict(vars(cls)))
+
+
+def _module_view(module):
+    """
+    A fresh module object per import with the public attributes of an allowed module.
+    Students can reassign its attributes (math.sqrt = ...) without touching the real,
+    worker-wide module, and can't reach modules it imported itself (dataclasses.sys).
+    """
+    view = types.ModuleType(module.__name__)
+    for name, value in vars(module).items():
+        if name.startswith("_"):
+            continue
+        if isinstance(value, types.ModuleType):
+            # Only its own submodules (collections.abc), as views too
+            if not value.__name__.startswith(module.__name__ + "."):
+                continue
+            value = _module_view(value)
+        elif isinstance(value, type):
+            _remember_class(value)
+        setattr(view, name, value)
+    return view
+
+
+def _restore_shared_classes():
+    for cls, saved in _class_snapshots.values():
+        current = vars(cls)
+        if len(current) == len(saved) and all(current.get(k) is v for k, v in saved.items()):
+            continue
+        for name in [k for k in current if k not in saved]:
+            with contextlib.suppress(AttributeError, TypeError):
+                delattr(cls, name)
+        for name, value in saved.items():
+            if current.get(name) is not value:
+                with contextlib.suppress(AttributeError, TypeError):
+                    setattr(cls, name, value)
+
+
+def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level == 0 and name.split(".")[0] in ALLOWED_MODULES:
+        return _module_view(__import__(name, globals, locals, fromlist, level))
+    raise ImportError(f"Import of '{name}' is not allowed in the sandbox.")
+
+
+def _safe_builtins():
+    safe = {name: getattr(builtins, name) for name in SAFE_BUILTIN_NAMES}
+    safe["__build_class__"] = builtins.__build_class__
+    safe["__import__"] = _safe_import
+    return safe
+
+
+def _format_user_traceback(exc):
+    # Drop our own frame so students only see their code
+    return "".join(traceback.format_exception(type(exc), exc, exc.__traceback__.tb_next))
+
+
+def _on_alarm(signum, frame):
+    raise _BudgetExceeded()
+
+
+@contextlib.contextmanager
+def _time_limit(seconds):
+    """Interrupts the block after `seconds` without killing the (warm) worker."""
+    if not hasattr(signal, "setitimer"):
+        yield
+        return
+    signal.setitimer(signal.ITIMER_REAL, max(seconds, 0.001))
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+# --- RESOURCE ACCOUNTING (worker side) ---
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _vm_bytes():
+    """Current address-space size of this process, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _reset_peak_rss():
+    # Warm workers run many jobs; resetting the high-water mark makes peak RSS per job (Linux)
+    with contextlib.suppress(OSError):
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+
+def _peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _stack_depth():
+    depth, frame = 0, sys._getframe()
+    while frame is not None:
+        depth, frame = depth + 1, frame.f_back
+    return depth
+
+def _set_soft_limit(kind, soft):
+    _, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY and (soft == resource.RLIM_INFINITY or soft > hard):
+        soft = hard
+    resource.setrlimit(kind, (soft, hard))
+
+@contextlib.contextmanager
+def _resource_limits(job):
+    """
+    CPU time, address space and recursion depth quotas for one job.
+    The limits are relative to what this warm worker already uses and are lifted afterwards.
+    """
+    saved_recursion = sys.getrecursionlimit()
+    sys.setrecursionlimit(_stack_depth() + job["max_recursion"])
+    if resource is None:
+        try:
+            yield
+        finally:
+            sys.setrecursionlimit(saved_recursion)
+        return
+
+    saved_cpu = resource.getrlimit(resource.RLIMIT_CPU)[0]
+    saved_as = resource.getrlimit(resource.RLIMIT_AS)[0]
+    # RLIMIT_CPU has whole-second granularity (the quota rounds up); going over it sends SIGXCPU
+    _set_soft_limit(resource.RLIMIT_CPU, math.ceil(_cpu_seconds() + job["cpu_limit"]))
+    vm = _vm_bytes()
+    if vm is not None and job["memory_limit_mb"]:
+        _set_soft_limit(resource.RLIMIT_AS, vm + job["memory_limit_mb"] * 1024 * 1024)
+    try:
+        yield
+    finally:
+        _set_soft_limit(resource.RLIMIT_AS, saved_as)
+        _set_soft_limit(resource.RLIMIT_CPU, saved_cpu)
+        sys.setrecursionlimit(saved_recursion)
+
+
+class _CappedOutput(io.TextIOBase):
+    """
+    stdout for student code. Keeps at most `max_bytes` / `max_lines` of text, sends it
+    on as ("output", {"text": ...}) chunks while the program runs, and drops the rest
+    after a truncation marker, so an output bomb costs neither memory nor bandwidth.
+    A finished line is sent right away, so a print before a long computation shows up live.
+    """
 
-def _run_script(code, queue):
-    output_buffer = io.StringIO()
-    # Secure Sandbox
-    safe_globals = {"__builtins__": {
-        "print": print, "range": range, "len": len, "int": int, "float": float,
-        "str": str, "list": list, "dict": dict, "set": set, "bool": bool,
-        "abs": abs, "round": round, "min": min, "max": max, "sum": sum,
-    }}
+    def __init__(self, emit, max_bytes, max_lines):
+        self._emit = emit
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.bytes = 0
+        self.lines = 0
+        self.truncated = False
+        self._kept = []
+        self._pending = []
+        self._pending_bytes = 0
+        # So the first thing printed is sent straight away
+        self._last_flush = float("-inf")
 
+    def writable(self):
+        return True
+
+    def _cut(self, text, size):
+        # Keep only what still fits under both caps
+        lines_left = self.max_lines - self.lines
+        if text.count("\n") > lines_left:
+            text = "\n".join(text.split("\n")[:lines_left + 1])
+        encoded = text.encode("utf-8", "replace")
+        if self.bytes + len(encoded) > self.max_bytes:
+            text = encoded[:max(0, self.max_bytes - self.bytes)].decode("utf-8", "ignore")
+        limit = f"{self.max_bytes} bytes" if self.bytes + size > self.max_bytes else f"{self.max_lines} lines"
+        return f"{text}\n✂️ Output truncated: your program printed more than {limit}.\n"
+
+    def write(self, text):
+        if self.truncated or not text:
+            return len(text)
+
+        size = len(text.encode("utf-8", "replace"))
+        line_count = text.count("\n")
+        kept = text
+        if self.bytes + size > self.max_bytes or self.lines + line_count > self.max_lines:
+            kept = self._cut(text, size)
+            self.truncated = True
+        self.bytes += size
+        self.lines += line_count
+
+        self._kept.append(kept)
+        self._pending.append(kept)
+        self._pending_bytes += len(kept)
+        # max_lines bounds how many line-by-line sends a chatty program can cause
+        if (self.truncated or "\n" in kept or self._pending_bytes >= OUTPUT_CHUNK_BYTES
+                or time.monotonic() - self._last_flush >= OUTPUT_FLUSH_INTERVAL):
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._pending:
+            self._emit("output", {"text": "".join(self._pending)})
+            self._pending = []
+            self._pending_bytes = 0
+        self._last_flush = time.monotonic()
+
+    def getvalue(self):
+        return "".join(self._kept)
+
+
+# Every signal that raises _BudgetExceeded in the worker (see _worker_loop)
+_BUDGET_SIGNALS = {getattr(signal, name) for name in ("SIGALRM", "SIGXCPU") if hasattr(signal, name)}
+
+
+@contextlib.contextmanager
+def _alarm_deferred():
+    """Holds back SIGALRM/SIGXCPU for the block; a pending one fires right after it."""
+    if not hasattr(signal, "pthread_sigmask"):
+        yield
+        return
+    signal.pthread_sigmask(signal.SIG_BLOCK, _BUDGET_SIGNALS)
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, _BUDGET_SIGNALS)
+
+
+def _clip(text, max_bytes):
+    """`text` cut to max_bytes of UTF-8, so one huge value can't blow up the case event."""
+    encoded = text.encode("utf-8", "replace")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max(0, max_bytes - len(CLIPPED_MARKER.encode("utf-8")))].decode("utf-8", "ignore") + CLIPPED_MARKER
+
+
+def _run_case(user_func, case_id, case, budget, max_bytes=OUTPUT_MAX_BYTES):
+    inputs = case["input"]
+    expected = case["expected"]
+    result = {"id": case_id, "input": _clip(str(inputs), max_bytes), "expected": _clip(str(expected), max_bytes)}
+    started = time.perf_counter()
     try:
-        with contextlib.redirect_stdout(output_buffer):
-            exec(code, safe_globals)
-        queue.put({"success": True, "output": output_buffer.getvalue()})
-    except Exception:
-        queue.put({"success": False, "output": traceback.format_exc()})
+        with _time_limit(budget):
+            actual = user_func(*inputs)
+            passed = actual == expected
+            # str() of a returned value runs student code too (__str__, huge containers), so it is timed
+            actual = str(actual)
+        result.update(actual=_clip(actual, max_bytes), passed=passed, status="passed" if passed else "failed")
+    except _BudgetExceeded:
+        result.update(actual=f"⏱️ Time Limit Exceeded ({budget:.2f}s)", passed=False, status="timeout")
+    except MemoryError:
+        result.update(actual=CASE_MEMORY_MESSAGE, passed=False, status="error")
+    except Exception as e:
+        result.update(actual=str(e), passed=False, status="error")
+    result["time_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def _run_tests(job, safe_globals, deadline, emit):
+    entry = job["entry"]
+    user_func = safe_globals.get(entry) if entry else None
+    if not callable(user_func):
+        result = {"id": 0, "passed": False, "status": "error", "actual": "No function definition found."}
+        emit("case", result)
+        return [result]
+
+    test_results = []
+    stop = False
+    for i, case in enumerate(job["test_cases"]):
+        remaining = deadline - time.monotonic()
+        if stop or remaining <= 0:
+            result = {"id": i + 1, "input": _clip(str(case["input"]), job["max_output_bytes"]),
+                      "expected": _clip(str(case["expected"]), job["max_output_bytes"]),
+                      "actual": "Skipped.", "passed": False, "status": "skipped"}
+        else:
+            result = _run_case(user_func, i + 1, case, min(job["case_timeout"], remaining),
+                               job["max_output_bytes"])
+            stop = job["fail_fast"] and not result["passed"]
+        test_results.append(result)
+        emit("case", result)
+    return test_results
+
+
+def _execute(job, emit, output_buffer, timings):
+    deadline = time.monotonic() + job["total_timeout"]
+    safe_globals = {"__builtins__": _safe_builtins(), "__name__": "__main__"}
+    memory_message = MEMORY_MESSAGE.format(job["memory_limit_mb"])
+
+    with contextlib.redirect_stdout(output_buffer):
+        started = time.perf_counter()
+        try:
+            with _time_limit(job["total_timeout"]):
+                exec(marshal.loads(job["compiled"]), safe_globals)
+        except _BudgetExceeded:
+            return {"success": False, "output": TIMEOUT_MESSAGE}
+        except MemoryError:
+            # The heap may be left fragmented and huge; let the pool replace this worker
+            return {"success": False, "output": memory_message, "recycle": True}
+        except Exception as e:
+            return {"success": False, "output": _format_user_traceback(e)}
+        finally:
+            timings["sandbox.exec"] = time.perf_counter() - started
+
+        test_results = []
+        if job["test_cases"]:
+            started = time.perf_counter()
+            try:
+                test_results = _run_tests(job, safe_globals, deadline, emit)
+            except _BudgetExceeded:
+                # SIGXCPU between cases (outside a case's own time limit): the job's CPU quota is spent
+                return {"success": False, "output": CPU_MESSAGE.format(job["cpu_limit"])}
+            finally:
+                timings["sandbox.tests"] = time.perf_counter() - started
+
+    passed = sum(1 for r in test_results if r["passed"])
+    return {
+        "success": True,
+        "output": output_buffer.getvalue(),
+        "test_results": test_results,
+        "summary": {"passed": passed, "total": len(job["test_cases"] or [])},
+        "recycle": any(r["actual"] == CASE_MEMORY_MESSAGE for r in test_results),
+    }
+
+
+def _run_job(job, emit):
+    """
+    Executes one compiled submission (and its test cases, if any) in a fresh namespace,
+    under the job's quotas. Adds what it used as result["usage"].
+    """
+    output_buffer = _CappedOutput(emit, job["max_output_bytes"], job["max_output_lines"])
+    # Stage timings measured here; the pool moves them into the API process's metrics
+    timings = {}
+
+    if resource is not None:
+        _reset_peak_rss()
+        cpu_started = _cpu_seconds()
+    wall_started = time.perf_counter()
+    try:
+        with _resource_limits(job):
+            result = _execute(job, emit, output_buffer, timings)
+    finally:
+        output_buffer.flush()
+
+    usage = {"wall_ms": round((time.perf_counter() - wall_started) * 1000, 2)}
+    if resource is not None:
+        usage["cpu_ms"] = round((_cpu_seconds() - cpu_started) * 1000, 2)
+        usage["peak_rss_kb"] = _peak_rss_bytes() // 1024
+    result["usage"] = usage
+    result["timings"] = timings
+    return result
+
+
+def _worker_loop(conn):
+    """Main loop of a warm sandbox process: receive a job, stream events, send its result."""
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _on_alarm)
+    if hasattr(signal, "SIGXCPU"):
+        # Over the job's CPU quota: stopped the same way as the wall-clock budget
+        signal.signal(signal.SIGXCPU, _on_alarm)
+    if WORKER_NICE and hasattr(os, "nice"):
+        with contextlib.suppress(OSError):
+            os.nice(WORKER_NICE)
 
-def execute_code_safely(code: str, timeout: float = 2.0) -> dict:
-    queue = multiprocessing.Queue()
-    process = multiprocessing.Process(target=_run_script, args=(code, queue))
-    process.start()
-    process.join(timeout)
+    def emit(kind, payload):
+        # Output is sent while student code runs; an alarm mid-send would leave half a message in the pipe
+        with _alarm_deferred():
+            conn.send((kind, payload))
 
-    if process.is_alive():
-        process.terminate()
-        return {"success": False, "output": "⏱️ Time Limit Exceeded: Check for infinite loops!"}
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        try:
+            result = _run_job(job, emit)
+        except BaseException:
+            result = {"success": False, "output": traceback.format_exc()}
+        emit("done", result)
+        # Modules are per-job views already; shared classes are put back here
+        _restore_shared_classes()
 
-    if not queue.empty():
-        return queue.get()
 
-    return {"success": False, "output": "Unknown execution error."}
\ No newline at end of file
+# --- IN THE API PROCESS ---
+
+class SandboxWorker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_loop, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.runs = 0
+
+    def run(self, job, timeout, on_event=None):
+        """
+        Returns the worker's final result dict, or None if it did not finish in time.
+        Intermediate events (e.g. per-case results) are passed to on_event as they arrive.
+        """
+        self.runs += 1
+        self.conn.send(job)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.conn.poll(remaining):
+                return None
+            kind, payload = self.conn.recv()
+            if kind == "done":
+                return payload
+            if on_event:
+                on_event(kind, payload)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        with contextlib.suppress(Exception):
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join(1)
+        with contextlib.suppress(Exception):
+            self.conn.close()
+
+
+class SandboxPool:
+    """
+    A fixed set of pre-started sandbox processes that are reused between runs.
+    Workers are replaced after `max_runs` jobs, after a timeout, or if they die.
+    At most `size + max_queue` runs are admitted; the rest get SandboxBusy.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_runs=MAX_RUNS_PER_WORKER,
+                 max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        self.size = max(1, size)
+        self.max_runs = max_runs
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._ctx = multiprocessing.get_context()
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._started = False
+        self._dispatch = None
+
+    @property
+    def started(self):
+        return self._started
+
+    @property
+    def queue_depth(self):
+        """Number of admitted runs still waiting for a free worker."""
+        return max(0, self._pending - self.size)
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(SandboxWorker(self._ctx))
+            # One dispatch thread per admissible run, so waiting never eats FastAPI's threadpool
+            self._dispatch = ThreadPoolExecutor(
+                max_workers=self.size + self.max_queue, thread_name_prefix="sandbox"
+            )
+            self._started = True
+
+    def shutdown(self):
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+            while True:
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                with contextlib.suppress(Exception):
+                    worker.conn.send(None)
+                worker.stop()
+            self._dispatch.shutdown(wait=False)
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.size + self.max_queue:
+                SANDBOX_EVENTS.inc(event="busy")
+                raise SandboxBusy("All sandboxes are busy. Please retry in a moment.")
+            self._pending += 1
+
+    def _run_admitted(self, job, timeout, on_event=None):
+        try:
+            try:
+                with stage("sandbox.wait"):
+                    worker = self._idle.get(timeout=self.queue_timeout)
+            except queue.Empty:
+                SANDBOX_EVENTS.inc(event="busy")
+                raise SandboxBusy("Timed out waiting for a free sandbox.")
+
+            recycle = False
+            try:
+                with stage("sandbox.run"):
+                    result = worker.run(job, timeout, on_event)
+                if result is None:
+                    SANDBOX_EVENTS.inc(event="timeout")
+                    result = {"success": False, "output": TIMEOUT_MESSAGE}
+                    recycle = True
+                elif result.pop("recycle", False):
+                    SANDBOX_EVENTS.inc(event="memory_limit")
+                    recycle = True
+            except (EOFError, OSError):
+                SANDBOX_EVENTS.inc(event="crash")
+                result = {"success": False, "output": CRASH_MESSAGE}
+                recycle = True
+            finally:
+                if recycle or worker.runs >= self.max_runs or not worker.is_alive():
+                    worker.stop()
+                    SANDBOX_EVENTS.inc(event="respawn")
+                    with stage("sandbox.spawn"):
+                        worker = SandboxWorker(self._ctx)
+                self._idle.put(worker)
+
+            for name, seconds in result.pop("timings", {}).items():
+                record_stage(name, seconds)
+            usage = result.get("usage") or {}
+            if "cpu_ms" in usage:
+                SANDBOX_CPU_SECONDS.observe(usage["cpu_ms"] / 1000)
+                SANDBOX_PEAK_RSS_BYTES.observe(usage["peak_rss_kb"] * 1024)
+            if not recycle and not result["success"] and result["output"] == TIMEOUT_MESSAGE:
+                SANDBOX_EVENTS.inc(event="timeout")  # caught by the worker's own alarm
+            for case in result.get("test_results") or ():
+                if case.get("status") == "timeout":
+                    SANDBOX_EVENTS.inc(event="case_timeout")
+            return result
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def run(self, job, timeout=None, on_event=None):
+        """Blocking run of one job on a warm worker."""
+        self.start()
+        self._admit()
+        return self._run_admitted(job, timeout or job["total_timeout"] + KILL_GRACE, on_event)
+
+    def _dispatch_admitted(self, fn, *args):
+        try:
+            # Carry the request's context over so stage timings land in its trace
+            context = contextvars.copy_context()
+            return asyncio.get_running_loop().run_in_executor(self._dispatch, context.run, fn, *args)
+        except BaseException:
+            # Never dispatched, so _run_admitted will not release the slot for us
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    async def run_async(self, job, timeout=None):
+        """Same as run(), but waits on a dispatch thread so the event loop stays free."""
+        self.start()
+        self._admit()
+        timeout = timeout or job["total_timeout"] + KILL_GRACE
+        return await self._dispatch_admitted(self._run_admitted, job, timeout)
+
+    async def stream_async(self, job, timeout=None):
+        """
+        Async generator of (kind, payload) events for one job.
+        Yields worker events as they happen and ends with ("done", result).
+        """
+        self.start()
+        self._admit()
+        timeout = timeout or job["total_timeout"] + KILL_GRACE
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def on_event(kind, payload):
+            with contextlib.suppress(RuntimeError):  # loop already closed
+                loop.call_soon_threadsafe(events.put_nowait, (kind, payload))
+
+        def work():
+            try:
+                result = self._run_admitted(job, timeout, on_event)
+            except BaseException as e:
+                result = e
+            on_event("done", result)
+
+        self._dispatch_admitted(work)
+        while True:
+            kind, payload = await events.get()
+            if kind == "done" and isinstance(payload, BaseException):
+                raise payload
+            yield kind, payload
+            if kind == "done":
+                return
+
+
+sandbox_pool = SandboxPool()
+
+registry.gauge(
+    "deepblue_sandbox_queue_depth", "Admitted runs waiting for a free sandbox worker.",
+    lambda: sandbox_pool.queue_depth,
+)
+
+
+def execute_code_safely(code: str, timeout: float = 2.0, test_cases=None) -> dict:
+    try:
+        tree = preflight(code)
+        job = build_job(code, test_cases=test_cases, total_timeout=timeout, tree=tree)
+    except PreflightError as e:
+        return {"success": False, "output": str(e)}
+    return sandbox_pool.run(job)
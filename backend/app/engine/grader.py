@@ -0,0 +1,108 @@
+import ast
+import json
+import functools
+
+from app.engine.executor import sandbox_pool, build_job, CASE_TIMEOUT, TOTAL_TIMEOUT
+from app.engine.preflight import preflight, PreflightError
+from app.engine.grading_cache import grading_cache, grading_key
+
+
+@functools.lru_cache(maxsize=256)
+def _starter_entry_point(starter_code):
+    """Name of the function a mission's starter code asks the student to write."""
+    try:
+        tree = ast.parse(starter_code)
+    except SyntaxError:
+        return None
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            return node.name
+    return None
+
+
+def build_grading_job(code, mission=None, fail_fast=False,
+                      case_timeout=CASE_TIMEOUT, total_timeout=TOTAL_TIMEOUT, tree=None):
+    """
+    One job = compiled submission + every test case of the mission.
+    The whole batch is graded by a single worker in a single round trip.
+    """
+    test_cases, entry = None, None
+    if mission and "test_cases" in mission:
+        test_cases = mission["test_cases"]
+        entry = _starter_entry_point(mission.get("starter_code", ""))
+
+    return build_job(
+        code, test_cases=test_cases, entry=entry, case_timeout=case_timeout,
+        total_timeout=total_timeout, fail_fast=fail_fast, tree=tree,
+    )
+
+
+def prepare_submission(code, mission=None, fail_fast=False):
+    """
+    Pre-flights a submission (parse + static checks, cached by source) and returns
+    (tree, grading job), so grading, visualization and the tutor cache share one AST.
+    Raises PreflightError without touching a sandbox.
+    """
+    tree = preflight(code)
+    job = build_grading_job(code, mission, fail_fast=fail_fast, tree=tree)
+    job["grading_key"] = grading_key(mission, tree, fail_fast)
+    return tree, job
+
+
+async def run_grading(job):
+    """Result of a job from prepare_submission: from the grading cache, else from a sandbox run."""
+    key = job.pop("grading_key", None)
+    cached = grading_cache.get(key)
+    if cached is not None:
+        return cached
+    result = await sandbox_pool.run_async(job)
+    grading_cache.put(key, result)
+    return result
+
+
+async def stream_job(job):
+    """
+    Events of a job from prepare_submission. A cache hit replays the stored stdout
+    and cases straight away and ends with a `done` result marked cached.
+    """
+    key = job.pop("grading_key", None)
+    cached = grading_cache.get(key)
+    if cached is not None:
+        if cached["output"]:
+            yield "output", {"text": cached["output"], "cached": True}
+        for case in cached["test_results"]:
+            yield "case", case
+        yield "done", cached
+        return
+    async for kind, payload in sandbox_pool.stream_async(job):
+        if kind == "done":
+            grading_cache.put(key, payload)
+        yield kind, payload
+
+
+async def grade_submission(code, mission=None, fail_fast=False):
+    """Runs and grades a submission; returns the worker's final result dict."""
+    try:
+        _, job = prepare_submission(code, mission, fail_fast=fail_fast)
+    except PreflightError as e:
+        return {"success": False, "output": str(e)}
+    return await run_grading(job)
+
+
+async def stream_grading(code, mission=None, fail_fast=False):
+    """
+    Async generator of (kind, payload): "output" chunks of stdout as they are printed,
+    one "case" per finished test, then "done".
+    """
+    try:
+        _, job = prepare_submission(code, mission, fail_fast=fail_fast)
+    except PreflightError as e:
+        yield "done", {"success": False, "output": str(e)}
+        return
+    async for kind, payload in stream_job(job):
+        yield kind, payload
+
+
+def sse_event(kind, payload):
+    """Formats one Server-Sent Event frame."""
+    return f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
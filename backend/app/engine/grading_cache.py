@@ -0,0 +1,132 @@
+import os
+import ast
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from app.metrics import count_lookup
+
+# --- GRADING CACHE CONFIG (overridable from .env) ---
+GRADING_CACHE_SIZE = int(os.getenv("GRADING_CACHE_SIZE", "4096"))
+
+# Case outcomes that depend on the code and the tests, not on how busy the host was
+DETERMINISTIC_STATUSES = {"passed", "failed", "error"}
+
+
+def mission_version(mission):
+    """Hash of everything grading reads from a mission; changes whenever its tests do."""
+    graded = {"test_cases": mission.get("test_cases"), "starter_code": mission.get("starter_code", "")}
+    blob = json.dumps(graded, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _uses_randomness(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import) and any(a.name.split(".")[0] == "random" for a in node.names):
+            return True
+        if isinstance(node, ast.ImportFrom) and (node.module or "").split(".")[0] == "random":
+            return True
+    return False
+
+
+def grading_key(mission, tree, fail_fast=False):
+    """
+    (mission_id, mission version, fail_fast, normalized AST hash), or None when the
+    submission can't be cached (no tests to grade, it draws random numbers, or its
+    AST is too deep to dump).
+    Comments and formatting don't change the AST, so equivalent variants share a key.
+    """
+    if not mission or not mission.get("test_cases") or mission.get("id") is None or tree is None:
+        return None
+    if _uses_randomness(tree):
+        return None
+    try:
+        dumped = ast.dump(tree)
+    except (RecursionError, MemoryError):
+        return None
+    code_hash = hashlib.blake2b(dumped.encode("utf-8"), digest_size=16).hexdigest()
+    return mission["id"], mission_version(mission), bool(fail_fast), code_hash
+
+
+def is_cacheable(result, fail_fast=False):
+    """Only complete runs whose every case outcome is reproducible are stored."""
+    if not result.get("success") or result.get("recycle"):
+        return False
+    failed = False
+    for case in result.get("test_results") or ():
+        if case.get("status") in DETERMINISTIC_STATUSES:
+            failed = failed or not case["passed"]
+            continue
+        # fail_fast skips the rest after a failure; skips from a spent time budget aren't stable
+        if case.get("status") == "skipped" and fail_fast and failed:
+            continue
+        return False
+    return True
+
+
+class GradingCache:
+    """
+    In-memory LRU of graded results, shared by every request in the process.
+    A hit skips the sandbox entirely; the stored stdout comes back marked `cached`.
+    Entries for an older version of a mission are dropped as soon as a new one is seen.
+    """
+
+    def __init__(self, max_entries=GRADING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> {"output", "test_results", "summary"}
+        self._versions = {}  # mission_id -> latest version seen
+        self._lock = threading.Lock()
+
+    def _invalidate_stale(self, mission_id, version):
+        # Caller holds the lock
+        if self._versions.get(mission_id, version) != version:
+            for key in [k for k in self._entries if k[0] == mission_id and k[1] != version]:
+                del self._entries[key]
+        self._versions[mission_id] = version
+
+    def get(self, key):
+        """A copy of the cached result for `key` (with cached=True), or None."""
+        if key is None:
+            return None
+        with self._lock:
+            self._invalidate_stale(key[0], key[1])
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        count_lookup("grading", entry is not None)
+        if entry is None:
+            return None
+        return {
+            "success": True,
+            "output": entry["output"],
+            "test_results": [dict(case) for case in entry["test_results"]],
+            "summary": dict(entry["summary"]),
+            "cached": True,
+        }
+
+    def put(self, key, result):
+        if key is None or not is_cacheable(result, fail_fast=key[2]):
+            return
+        entry = {
+            "output": result["output"],
+            "test_results": [dict(case) for case in result["test_results"]],
+            "summary": dict(result.get("summary") or {}),
+        }
+        with self._lock:
+            self._invalidate_stale(key[0], key[1])
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+grading_cache = GradingCache()
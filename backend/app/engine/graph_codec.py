@@ -0,0 +1,91 @@
+import json
+
+# Fast serializers are optional; plain json is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Media types a client can put in Accept to get the compact graph encoding
+COLUMNAR_MEDIA_TYPE = "application/vnd.deepblue.graph+json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def negotiate_format(accept: str) -> str:
+    """Picks "msgpack", "columnar" or the default "json" from an Accept header."""
+    accept = (accept or "").lower()
+    if msgpack is not None and any(media in accept for media in MSGPACK_MEDIA_TYPES):
+        return "msgpack"
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return "columnar"
+    return "json"
+
+
+def encode_columnar(graph):
+    """
+    Graph as parallel arrays instead of one dict per node.
+    The graph is a tree, so `parents` (index into the arrays, -1 for top level)
+    replaces the links list; types and labels are interned into lookup tables.
+    Deltas and error graphs are passed through unchanged.
+    """
+    if not graph or "nodes" not in graph:
+        return graph
+
+    nodes = graph["nodes"]
+    index_of = {node["id"]: i for i, node in enumerate(nodes)}
+    parents = [-1] * len(nodes)
+    for link in graph["links"]:
+        parents[index_of[link["target"]]] = index_of[link["source"]]
+
+    type_table, type_codes = [], {}
+    label_table, label_codes = [], {}
+    ids, types, groups, labels, hidden = [], [], [], [], []
+    for i, node in enumerate(nodes):
+        ids.append(node["id"])
+        groups.append(node["group"])
+
+        type_code = type_codes.get(node["type"])
+        if type_code is None:
+            type_code = type_codes[node["type"]] = len(type_table)
+            type_table.append(node["type"])
+        types.append(type_code)
+
+        label_code = label_codes.get(node["label"])
+        if label_code is None:
+            label_code = label_codes[node["label"]] = len(label_table)
+            label_table.append(node["label"])
+        labels.append(label_code)
+
+        if node.get("collapsed"):
+            hidden.append([i, node["hidden"]])
+
+    encoded = {
+        "format": "columnar",
+        "ids": ids,
+        "types": types,
+        "type_table": type_table,
+        "groups": groups,
+        "parents": parents,
+        "labels": labels,
+        "label_table": label_table,
+        "collapsed": hidden,  # [node index, hidden count] pairs
+    }
+    for key in ("error", "version"):
+        if key in graph:
+            encoded[key] = graph[key]
+    return encoded
+
+
+def dumps_json(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_msgpack(payload) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True)
@@ -0,0 +1,82 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# How many sessions' last-sent graphs we remember
+MAX_TRACKED_SESSIONS = 2000
+
+
+def _link_key(link):
+    return (link["source"], link["target"])
+
+
+def graph_version(nodes, links):
+    """
+    Content hash of a graph's nodes and links. Every API worker computes the same
+    version for the same graph, so a client's version means the same thing on any of them.
+    """
+    blob = json.dumps(
+        [[nodes[node_id] for node_id in sorted(nodes, key=str)], sorted(links, key=str)],
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class GraphDeltaTracker:
+    """
+    Remembers the last graph sent to each session so later responses can carry
+    only what changed. Relies on the parser's stable node IDs.
+    """
+
+    def __init__(self, max_sessions=MAX_TRACKED_SESSIONS):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # session_id -> (content version, {node_id: node}, {(source, target)})
+        self._sessions = OrderedDict()
+
+    def update(self, session_id, graph, client_version=None):
+        """
+        Returns a delta against the graph the client holds (`client_version`),
+        or the full graph (tagged with a version) when the client has nothing usable.
+        """
+        if "error" in graph:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            return graph
+
+        nodes = {node["id"]: node for node in graph["nodes"]}
+        links = {_link_key(link) for link in graph["links"]}
+
+        with self._lock:
+            previous = self._sessions.pop(session_id, None)
+            version = graph_version(nodes, links)
+            self._sessions[session_id] = (version, nodes, links)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+        # A client version from another worker only matches if it is the very same graph
+        if previous is None or client_version != previous[0]:
+            return {**graph, "version": version}
+
+        _, old_nodes, old_links = previous
+        return {
+            "delta": True,
+            "base_version": previous[0],
+            "version": version,
+            "added_nodes": [n for node_id, n in nodes.items() if node_id not in old_nodes],
+            "changed_nodes": [
+                n for node_id, n in nodes.items()
+                if node_id in old_nodes and old_nodes[node_id] != n
+            ],
+            "removed_nodes": [node_id for node_id in old_nodes if node_id not in nodes],
+            "added_links": [{"source": s, "target": t} for s, t in links - old_links],
+            "removed_links": [{"source": s, "target": t} for s, t in old_links - links],
+        }
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+graph_tracker = GraphDeltaTracker()
@@ -0,0 +1,89 @@
+import os
+import time
+import asyncio
+import contextlib
+
+from app.metrics import registry, stage
+
+# --- LIMITER CONFIG (overridable from .env) ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10.0"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30.0"))
+
+
+class LLMBusy(Exception):
+    """Raised when the outbound LLM queue is full or a caller waited too long for a slot."""
+
+
+class LLMLimiter:
+    """
+    Process-wide cap on outbound LLM calls.
+    At most `max_concurrency` calls run at once, at most `max_queue` wait behind them,
+    and every call gets a hard `call_timeout`.
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                 queue_timeout=LLM_QUEUE_TIMEOUT, call_timeout=LLM_CALL_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        # Created on first use so it binds to the server's event loop, not the importer's
+        self._sem = None
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+
+        if self._sem.locked() and self.waiting >= self.max_queue:
+            raise LLMBusy("The AI tutor is at capacity. Please try again shortly.")
+
+        self.waiting += 1
+        try:
+            with stage("llm.wait"):
+                await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise LLMBusy("Timed out waiting for the AI tutor.")
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+    async def run(self, make_call):
+        """Awaits make_call() inside a slot, bounded by call_timeout."""
+        async with self.slot():
+            return await asyncio.wait_for(make_call(), self.call_timeout)
+
+    async def stream(self, agen):
+        """Re-yields an async iterator inside a slot; the whole stream shares call_timeout."""
+        async with self.slot():
+            deadline = time.monotonic() + self.call_timeout
+            iterator = agen.__aiter__()
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        return
+                    yield chunk
+            finally:
+                with contextlib.suppress(Exception):
+                    await iterator.aclose()
+
+
+llm_limiter = LLMLimiter()
+
+registry.gauge("deepblue_llm_in_flight", "Tutor LLM calls currently running.", lambda: llm_limiter.in_flight)
+registry.gauge("deepblue_llm_waiting", "Tutor LLM calls queued for a slot.", lambda: llm_limiter.waiting)
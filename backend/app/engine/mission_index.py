@@ -0,0 +1,161 @@
+import os
+import re
+import math
+import threading
+
+# NumPy is optional; without it the tutor simply gets no retrieved context
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from app.catalog import mission_catalog
+
+# --- RETRIEVAL CONFIG (overridable from .env) ---
+# Related missions mentioned in the tutor's system prompt
+TUTOR_RELATED_MISSIONS = int(os.getenv("TUTOR_RELATED_MISSIONS", "2"))
+# Cosine similarity below this is treated as "not related"
+MIN_SCORE = float(os.getenv("TUTOR_RETRIEVAL_MIN_SCORE", "0.3"))
+
+# Words, split at underscores, digits and punctuation so `reconstruct_cell` matches "reconstruct the cell"
+TOKEN_RE = re.compile(r"[a-z]+")
+# A free-text query must share at least this many distinct words with the index to match anything
+MIN_QUERY_TERMS = 2
+STOPWORDS = frozenset(
+    "a an and are as at be by for from given if in into is it its of on or that the their "
+    "this to with your you my me do how what why analyze logic review solution mission "
+    # Python keywords and builtins appear in nearly every snippet and say nothing about the topic
+    "def return self class import while else elif not none true false lambda pass break "
+    "continue try except print range len list dict set int str float bool sum min max "
+    "enumerate zip sorted append".split()
+)
+
+
+def tokenize(text: str):
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _document(mission):
+    """Everything about a mission worth matching on; the title counts twice."""
+    roles = mission.get("roles") or {}
+    parts = [
+        mission.get("title", ""), mission.get("title", ""), mission.get("category_tag", ""),
+        mission.get("description", ""), " ".join(str(v) for v in roles.values()),
+        mission.get("starter_code", ""), " ".join(str(k) for k in mission.get("solution_keywords") or ()),
+    ]
+    return " ".join(p for p in parts if p)
+
+
+class MissionIndex:
+    """
+    In-process TF-IDF index over missions.json (descriptions, roles, starter code, keywords).
+    One normalized row per mission, so a lookup is a single matrix-vector product.
+    Rebuilt automatically when the mission catalog changes on disk.
+    """
+
+    def __init__(self, catalog=mission_catalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._version = None
+        self._ids = []
+        self._rows = {}  # mission_id -> row
+        self._vocab = {}  # token -> column
+        self._idf = None
+        self._matrix = None
+        self._related = {}  # mission_id -> related missions; stable until the next rebuild
+
+    @property
+    def ready(self):
+        return self._matrix is not None
+
+    def build(self):
+        """(Re)builds the index from the catalog; cheap enough to run at startup."""
+        if np is None:
+            return
+        _, version = self.catalog.rendered(True)
+        missions = [m for m in self.catalog.list(True) if m.get("id") is not None]
+        docs = [tokenize(_document(m)) for m in missions]
+
+        vocab = {}
+        for tokens in docs:
+            for token in tokens:
+                vocab.setdefault(token, len(vocab))
+        df = np.zeros(len(vocab), dtype=np.float32)
+        counts = np.zeros((len(docs), len(vocab)), dtype=np.float32)
+        for row, tokens in enumerate(docs):
+            for token in tokens:
+                counts[row, vocab[token]] += 1
+            df[[vocab[t] for t in set(tokens)]] += 1
+
+        idf = np.log((1 + len(docs)) / (1 + df)) + 1
+        matrix = np.where(counts > 0, 1 + np.log(np.maximum(counts, 1)), 0) * idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+        with self._lock:
+            self._ids = [m["id"] for m in missions]
+            self._rows = {mission_id: row for row, mission_id in enumerate(self._ids)}
+            self._vocab, self._idf, self._matrix = vocab, idf.astype(np.float32), matrix
+            self._related = {}
+            self._version = version
+
+    def _current(self):
+        if np is None:
+            return False
+        if self._version != self.catalog.rendered(True)[1]:
+            self.build()
+        return self._matrix is not None and len(self._ids) > 0
+
+    def _vectorize(self, text: str):
+        vector = np.zeros(len(self._vocab), dtype=np.float32)
+        counts = {}
+        for token in tokenize(text):
+            column = self._vocab.get(token)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        if len(counts) < MIN_QUERY_TERMS:
+            return None  # one shared word is a coincidence, not a topic
+        columns = list(counts)
+        vector[columns] = [1 + math.log(counts[c]) for c in columns]
+        vector *= self._idf
+        return vector / np.linalg.norm(vector)
+
+    def _top(self, scores, k, exclude=None):
+        if exclude is not None:
+            scores[exclude] = -1.0
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        found = []
+        for row in best:
+            if scores[row] < MIN_SCORE:
+                break
+            mission = self.catalog.get(self._ids[row])
+            if mission is not None:
+                found.append((mission, float(scores[row])))
+        return found
+
+    def search(self, hints: str, k: int = 1):
+        """[(mission, score)] best matching free text (a question, the student's code), best first."""
+        if not hints or not self._current():
+            return []
+        query = self._vectorize(hints)
+        if query is None:
+            return []
+        return self._top(self._matrix @ query, k)
+
+    def related(self, mission_id, k: int = TUTOR_RELATED_MISSIONS):
+        """Missions most similar to this one (not including it); cached per mission."""
+        if not self._current() or mission_id not in self._rows:
+            return []
+        cached = self._related.get((mission_id, k))
+        if cached is None:
+            row = self._rows[mission_id]
+            cached = [m for m, _ in self._top(self._matrix @ self._matrix[row], k, exclude=row)]
+            self._related[(mission_id, k)] = cached
+        return cached
+
+
+mission_index = MissionIndex()
@@ -0,0 +1,149 @@
+import os
+import re
+import difflib
+import functools
+
+from app.engine.session_memory import CODE_MARKER, DIFF_MARKER, estimate_tokens
+
+# --- PROMPT CONFIG (overridable from .env) ---
+# Tokens for the new human turn (question + code); history has its own TUTOR_HISTORY_TOKEN_BUDGET
+TUTOR_INPUT_TOKEN_BUDGET = int(os.getenv("TUTOR_INPUT_TOKEN_BUDGET", "1200"))
+# Send the full code again after this many diff-only turns, so the model never drifts far
+TUTOR_SNAPSHOT_EVERY = int(os.getenv("TUTOR_SNAPSHOT_EVERY", "4"))
+PROMPT_CACHE_SIZE = 256
+
+# Base Socratic Personality Definition
+BASE_SYSTEM_PROMPT = """
+You are 'Deep Blue', a Socratic Coding Tutor, guiding a student through complex cyber raids using Python.
+Your communication must match the current mission's active role.
+
+RULES:
+1. NEVER give the full code solution. Focus on guided discovery.
+2. Keep your responses short (under 3 sentences).
+3. Be encouraging and maintain the "futuristic combat/programming" tone.
+4. If the student's code is empty or syntactically correct but doesn't solve the mission, refer to the MISSION OBJECTIVE.
+"""
+
+DEFAULT_OBJECTIVE = "General code review."
+DEFAULT_ROLE_DESCRIPTION = "Focus on the Python syntax required for the logic."
+# We will cycle the focus to keep the tutor dynamic. Let's default to Translator.
+DEFAULT_ROLE = "Translator"
+
+# Mission details some clients paste into user_input
+OBJECTIVE_RE = re.compile(r"MISSION OBJECTIVE: (.*?)\n", re.DOTALL)
+TRANSLATOR_RE = re.compile(r"Translator: (.*?)\n", re.DOTALL)
+MISSION_BLOCK_RE = re.compile(r"MISSION OBJECTIVE:.*?Debugger:.*?$", re.DOTALL)
+
+UNCHANGED_CODE = f"{DIFF_MARKER} (no changes since the last message)"
+# Questions get at most this share of the input budget; the code gets the rest
+QUESTION_SHARE = 0.25
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def parse_user_input(user_input: str):
+    """(objective, role description, question) from the raw user_input; parsed once per distinct input."""
+    match_objective = OBJECTIVE_RE.search(user_input)
+    match_translator = TRANSLATOR_RE.search(user_input)
+    objective = match_objective.group(1).strip() if match_objective else DEFAULT_OBJECTIVE
+    role_description = match_translator.group(1).strip() if match_translator else DEFAULT_ROLE_DESCRIPTION
+    # The mission context goes into the system prompt, so it is cut from the human turn
+    question = MISSION_BLOCK_RE.sub("", user_input).strip()
+    return objective, role_description, question
+
+
+def mission_context(mission, user_input: str = ""):
+    """(objective, role description, question), from the catalog mission when there is one."""
+    objective, role_description, question = parse_user_input(user_input)
+    if mission:
+        objective = mission.get("description") or objective
+        role_description = (mission.get("roles") or {}).get("translator") or role_description
+    return objective, role_description, question
+
+
+def mission_briefing(mission, related=()):
+    """Extra context for the system prompt: the mission's other role notes and related missions."""
+    roles = (mission or {}).get("roles") or {}
+    lines = [f"{name.title()} notes: {roles[name]}" for name in ("architect", "debugger") if roles.get(name)]
+    if related:
+        titles = "; ".join(m.get("title", "") for m in related)
+        lines.append(f"RELATED MISSIONS (point back to them if useful): {titles}")
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def system_prompt(objective: str, role: str = DEFAULT_ROLE, role_description: str = DEFAULT_ROLE_DESCRIPTION,
+                  briefing: str = ""):
+    """The full system prompt; built once per mission context."""
+    return f"""
+{BASE_SYSTEM_PROMPT}
+
+CURRENT MISSION CONTEXT:
+MISSION OBJECTIVE: {objective}
+YOUR CURRENT ROLE ({role}): {role_description}
+{briefing}
+
+You must respond as the designated {role}. Use the current student's code below as context for your Socratic guidance.
+"""
+
+
+def truncate_text(text: str, max_tokens: int):
+    """(text, truncated): cut to roughly max_tokens, keeping the head and tail lines."""
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    budget = max(0, (max_tokens - 16) * 4)  # ~4 characters per token, minus the marker
+    lines = text.splitlines()
+    head = tail = used = 0
+    # Alternate head/tail so both the signature and the latest edits at the bottom survive
+    while head + tail < len(lines):
+        from_head = head <= tail
+        line = lines[head] if from_head else lines[-1 - tail]
+        if used + len(line) + 1 > budget:
+            break
+        used += len(line) + 1
+        if from_head:
+            head += 1
+        else:
+            tail += 1
+    if not head:
+        return text[:budget], True  # a single huge line
+    dropped = len(lines) - head - tail
+    kept_tail = lines[len(lines) - tail:] if tail else []
+    return "\n".join(lines[:head] + [f"# ... {dropped} line(s) truncated ..."] + kept_tail), True
+
+
+def _diff(old: str, new: str):
+    lines = difflib.unified_diff(old.splitlines(), new.splitlines(), "before", "after", n=1, lineterm="")
+    return "\n".join(lines)
+
+
+def code_block(code: str, last_code, diff_turns: int, max_tokens: int):
+    """
+    (text, snapshot, truncated) for the code part of a human turn: a unified diff against the code
+    the tutor last saw, or the full (budgeted) code when there's no usable base,
+    TUTOR_SNAPSHOT_EVERY diffs have gone by, or the diff wouldn't be any shorter.
+    """
+    snapshot, truncated = truncate_text(code, max_tokens)
+    full = f"{CODE_MARKER}\n{snapshot}"
+    if last_code is None or diff_turns >= TUTOR_SNAPSHOT_EVERY:
+        return full, True, truncated
+    if code == last_code:
+        return UNCHANGED_CODE, False, False
+    diff = f"{DIFF_MARKER}\n{_diff(last_code, code)}"
+    if truncated or estimate_tokens(diff) >= estimate_tokens(full):
+        return full, True, truncated
+    return diff, False, False
+
+
+def build_human_input(question: str, code: str, last_code=None, diff_turns: int = 0,
+                      max_tokens: int = TUTOR_INPUT_TOKEN_BUDGET):
+    """
+    (human turn, snapshot, code the tutor can rely on afterwards).
+    Question and code together stay within max_tokens; a truncated snapshot is not
+    a usable diff base, so the next turn sends the code in full again.
+    """
+    question, _ = truncate_text(question, int(max_tokens * QUESTION_SHARE))
+    block, snapshot, truncated = code_block(code, last_code, diff_turns, max_tokens - estimate_tokens(question))
+    seen = None if truncated else code
+    if question and not block.startswith(question):
+        block = f"{question}\n\n{block}"
+    return block, snapshot, seen
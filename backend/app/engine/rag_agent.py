@@ -1,40 +1,55 @@
 import os
-import re
+import asyncio
 from dotenv import load_dotenv
 
-# Modern LangChain Imports
-from langchain_google_genai import ChatGoogleGenerativeAI
+# Modern LangChain Imports (the Gemini client is imported only when it is used)
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import HumanMessage, AIMessage
+
+from app.engine.llm_limiter import llm_limiter
+from app.engine.tutor_cache import TutorCache, make_cache_key
+from app.engine.session_memory import SessionStore
+from app.engine.session_backends import make_session_backend
+from app.engine.prompt_builder import (
+    mission_context, mission_briefing, system_prompt, build_human_input, DEFAULT_ROLE, DEFAULT_OBJECTIVE,
+)
+from app.engine.mission_index import mission_index, TUTOR_RELATED_MISSIONS
+from app.metrics import stage, count_lookup, LLM_ERRORS
 
 # Load API Keys
 load_dotenv()
 
-# Base Socratic Personality Definition
-BASE_SYSTEM_PROMPT = """
-You are 'Deep Blue', a Socratic Coding Tutor, guiding a student through complex cyber raids using Python.
-Your communication must match the current mission's active role.
-
-RULES:
-1. NEVER give the full code solution. Focus on guided discovery.
-2. Keep your responses short (under 3 sentences).
-3. Be encouraging and maintain the "futuristic combat/programming" tone.
-4. If the student's code is empty or syntactically correct but doesn't solve the mission, refer to the MISSION OBJECTIVE.
-"""
-
 class SocraticAI:
-    def __init__(self):
-        # 1. Initialize the Google Brain
-        if not os.getenv("GOOGLE_API_KEY"):
-            raise ValueError("GOOGLE_API_KEY not found in .env file")
-
-        # NOTE: Model updated to gemini-2.5-flash-preview-09-2025 for best performance
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-preview-09-2025", 
-            temperature=0.5
-        )
+    def __init__(self, llm=None, limiter=llm_limiter, cache=None, index=mission_index):
+        # 1. Initialize the Google Brain (or any chat model passed in, e.g. a local fake)
+        if llm is None and os.getenv("TUTOR_FAKE_LLM"):
+            # Offline mode for benchmarks and local runs: no API key, no network
+            from app.engine.fake_llm import FakeTutorModel
+            llm = FakeTutorModel(
+                latency=float(os.getenv("TUTOR_FAKE_LLM_LATENCY", "0.5")),
+                token_delay=float(os.getenv("TUTOR_FAKE_LLM_TOKEN_DELAY", "0.02")),
+            )
+        if llm is None:
+            if not os.getenv("GOOGLE_API_KEY"):
+                raise ValueError("GOOGLE_API_KEY not found in .env file")
+            from langchain_google_genai import ChatGoogleGenerativeAI
+
+            # NOTE: Model updated to gemini-2.5-flash-preview-09-2025 for best performance
+            llm = ChatGoogleGenerativeAI(
+                model="gemini-2.5-flash-preview-09-2025", 
+                temperature=0.5
+            )
+        self.llm = llm
+        self.limiter = limiter
+        # Identical (code, mission, question) triples are answered without an LLM call
+        self.cache = cache if cache is not None else TutorCache()
+        # Local retrieval over missions.json: context comes from mission_id, not from pasted text
+        self.index = index
+        if self.index is not None:
+            with stage("tutor.index"):
+                self.index.build()
 
         # 2. Define the Prompt Template (Dynamic System Prompt)
         self.prompt = ChatPromptTemplate.from_messages([
@@ -46,72 +61,127 @@ class SocraticAI:
         # 3. Create the Chain (Chain remains the same structure)
         self.chain = self.prompt | self.llm | StrOutputParser()
 
-        # 4. Memory Management
-        self.store = {} 
-
-        def get_session_history(session_id: str) -> InMemoryChatMessageHistory:
-            if session_id not in self.store:
-                self.store[session_id] = InMemoryChatMessageHistory()
-            return self.store[session_id]
+        # 4. Memory Management (bounded: LRU/idle-TTL sessions, token-budgeted history).
+        # With TUTOR_SESSION_BACKEND=sqlite/redis, history is shared by all API workers.
+        self.store = SessionStore(backend=make_session_backend())
 
         self.conversation = RunnableWithMessageHistory(
             self.chain,
-            get_session_history,
+            self.get_session_history,
             input_messages_key="input",
             history_messages_key="history",
         )
 
-    def _extract_mission_context(self, user_input: str):
-        """Extracts mission details from the user_input string sent by the frontend."""
-        
-        # Regex to find the key sections of the mission detail string
-        match_objective = re.search(r"MISSION OBJECTIVE: (.*?)\n", user_input, re.DOTALL)
-        match_architect = re.search(r"Architect: (.*?)\n", user_input, re.DOTALL)
-        match_translator = re.search(r"Translator: (.*?)\n", user_input, re.DOTALL)
-        match_debugger = re.search(r"Debugger: (.*?)$", user_input, re.DOTALL)
-
-        # Set default values if not found
-        objective = match_objective.group(1).strip() if match_objective else "General code review."
-        
-        # We will cycle the focus to keep the tutor dynamic. Let's default to Translator.
-        role = "Translator"
-        role_description = match_translator.group(1).strip() if match_translator else "Focus on the Python syntax required for the logic."
-
-        # Attempt to detect which role is most relevant based on recent conversation history,
-        # but for simplicity in this backend model, we inject the most relevant pieces.
-        
-        return objective, role, role_description
-
-    def chat(self, user_input: str, user_code: str = "", session_id: str = "default_user"):
-        # 1. Extract Mission Context from User Input
-        objective, role, role_description = self._extract_mission_context(user_input)
-        
-        # 2. Build Dynamic System Prompt
-        dynamic_prompt = f"""
-{BASE_SYSTEM_PROMPT}
-
-CURRENT MISSION CONTEXT:
-MISSION OBJECTIVE: {objective}
-YOUR CURRENT ROLE ({role}): {role_description}
-
-You must respond as the designated {role}. Use the current student's code below as context for your Socratic guidance.
-"""
-        
-        # 3. Construct the Human Input
-        # Remove the mission context from the human input passed to the conversation, 
-        # as it's already in the system prompt now.
-        clean_input = re.sub(r"MISSION OBJECTIVE:.*?Debugger:.*?$", "", user_input, flags=re.DOTALL).strip()
-        
-        # Add code to the human input
-        full_human_input = f"[STUDENT'S CODE]:\n{user_code}"
-        if clean_input and not full_human_input.startswith(clean_input):
-            full_human_input = f"{clean_input}\n\n{full_human_input}"
-
-        # 4. Invoke the AI Conversation with dynamic system prompt
-        response = self.conversation.invoke(
-            {"input": full_human_input, "system_prompt": dynamic_prompt},
-            config={"configurable": {"session_id": session_id}}
-        )
+    def get_session_history(self, session_id: str):
+        return self.store.get(session_id)
+
+    def _build_inputs(self, user_input: str, user_code: str = "", tree=None,
+                      session_id: str = "default_user", mission=None):
+        """Turns the raw request into (conversation input dict, response cache key)."""
+        # 1. Mission context (cached system prompt per mission) and the student's question
+        objective, role_description, question = mission_context(mission, user_input)
+        related = []
+        if self.index is not None:
+            if mission is not None:
+                related = self.index.related(mission["id"])
+            elif objective == DEFAULT_OBJECTIVE:
+                # No mission and nothing pasted: close matches are only offered as hints,
+                # never as the objective, so free-form sessions stay free-form
+                related = [m for m, _ in self.index.search(f"{question}\n{user_code}", k=TUTOR_RELATED_MISSIONS)]
+        prompt = system_prompt(objective, DEFAULT_ROLE, role_description, mission_briefing(mission, related))
+
+        # 2. Human turn: question + the code, as a diff against what this session's tutor last saw
+        history = self.get_session_history(session_id)
+        last_code, diff_turns = history.code_context()
+        human_input, snapshot, seen = build_human_input(question, user_code, last_code, diff_turns)
+        history.expect_code(human_input, seen, snapshot)
+
+        inputs = {"input": human_input, "system_prompt": prompt}
+        return inputs, make_cache_key(user_code, objective, question, tree)
+
+    async def _abuild_inputs(self, *args):
+        if self.store.backend is None:
+            return self._build_inputs(*args)
+        # Reading a shared history is blocking I/O
+        return await asyncio.get_running_loop().run_in_executor(None, self._build_inputs, *args)
+
+    def _cached_turn(self, inputs: dict, response: str):
+        # A cache hit skips the model, so the turn is written into history by us
+        return [HumanMessage(content=inputs["input"]), AIMessage(content=response)]
+
+    def _record_cached_turn(self, session_id: str, inputs: dict, response: str):
+        self.get_session_history(session_id).add_messages(self._cached_turn(inputs, response))
+
+    async def _arecord_cached_turn(self, session_id: str, inputs: dict, response: str):
+        # Shared histories save to SQLite/Redis; aadd_messages does that off the event loop
+        await self.get_session_history(session_id).aadd_messages(self._cached_turn(inputs, response))
+
+    def _cached(self, cache_key: str):
+        response = self.cache.get(cache_key)
+        count_lookup("tutor", response is not None)
+        return response
+
+    def _config(self, session_id: str):
+        return {"configurable": {"session_id": session_id}}
+
+    def chat(self, user_input: str, user_code: str = "", session_id: str = "default_user", mission=None):
+        # Blocking call; kept for scripts. The API uses achat/astream_chat.
+        inputs, cache_key = self._build_inputs(user_input, user_code, None, session_id, mission)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            self._record_cached_turn(session_id, inputs, cached)
+            return cached
+
+        try:
+            with stage("llm.call"):
+                response = self.conversation.invoke(inputs, config=self._config(session_id))
+        except Exception as e:
+            LLM_ERRORS.inc(error=type(e).__name__)
+            raise
+        self.cache.put(cache_key, response)
+        return response
+
+    async def achat(self, user_input: str, user_code: str = "", session_id: str = "default_user",
+                    tree=None, mission=None):
+        """Non-blocking chat: waits for a limiter slot, then awaits the model."""
+        inputs, cache_key = await self._abuild_inputs(user_input, user_code, tree, session_id, mission)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            await self._arecord_cached_turn(session_id, inputs, cached)
+            return cached
+
+        try:
+            with stage("llm.call"):
+                response = await self.limiter.run(
+                    lambda: self.conversation.ainvoke(inputs, config=self._config(session_id))
+                )
+        except Exception as e:
+            LLM_ERRORS.inc(error=type(e).__name__)
+            raise
+        self.cache.put(cache_key, response)
         return response
 
-ai_tutor = SocraticAI()
\ No newline at end of file
+    async def astream_chat(self, user_input: str, user_code: str = "", session_id: str = "default_user",
+                           tree=None, mission=None):
+        """Yields response text chunks as the model produces them."""
+        inputs, cache_key = await self._abuild_inputs(user_input, user_code, tree, session_id, mission)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            await self._arecord_cached_turn(session_id, inputs, cached)
+            yield cached
+            return
+
+        parts = []
+        stream = self.conversation.astream(inputs, config=self._config(session_id))
+        try:
+            with stage("llm.stream"):
+                async for chunk in self.limiter.stream(stream):
+                    if chunk:
+                        parts.append(chunk)
+                        yield chunk
+        except Exception as e:
+            LLM_ERRORS.inc(error=type(e).__name__)
+            raise
+        self.cache.put(cache_key, "".join(parts))
+
+# The shared instance is built lazily by app.engine.tutor_loader
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Redis is optional; only needed for TUTOR_SESSION_BACKEND=redis
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from app.engine.session_memory import TUTOR_SESSION_IDLE_TTL
+
+# --- SESSION BACKEND CONFIG (overridable from .env) ---
+# "memory" (per process, the default), "sqlite" (one host, any number of workers) or "redis" (many hosts)
+TUTOR_SESSION_BACKEND = os.getenv("TUTOR_SESSION_BACKEND", "memory")
+TUTOR_SESSION_DB = os.getenv("TUTOR_SESSION_DB", "./tutor_sessions.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Expired SQLite rows are swept every this many saves
+SWEEP_EVERY = 200
+
+# Every backend stores one JSON state blob per session plus a version number that
+# goes up on each save:
+#   version(session_id) -> int or None          (cheap; used to validate cached state)
+#   load(session_id)    -> (version, state) or None
+#   save(session_id, state) -> new version
+#   delete(session_id)
+
+
+class SQLiteSessionBackend:
+    """Sessions in a local SQLite file (WAL), shared by every worker on the host."""
+
+    def __init__(self, path=TUTOR_SESSION_DB, idle_ttl=TUTOR_SESSION_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._saves = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tutor_sessions ("
+            "session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+            "state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _cutoff(self):
+        return time.time() - self.idle_ttl
+
+    def version(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version FROM tutor_sessions WHERE session_id = ? AND updated_at >= ?",
+                (session_id, self._cutoff()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version, state FROM tutor_sessions WHERE session_id = ? AND updated_at >= ?",
+                (session_id, self._cutoff()),
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def save(self, session_id, state):
+        payload = json.dumps(state, separators=(",", ":"))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT INTO tutor_sessions (session_id, version, state, updated_at) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET version = version + 1, "
+                    "state = excluded.state, updated_at = excluded.updated_at",
+                    (session_id, payload, time.time()),
+                )
+                version = self._db.execute(
+                    "SELECT version FROM tutor_sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+                self._saves += 1
+                if self._saves % SWEEP_EVERY == 0:
+                    self._db.execute("DELETE FROM tutor_sessions WHERE updated_at < ?", (self._cutoff(),))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return version
+
+    def delete(self, session_id):
+        with self._lock:
+            self._db.execute("DELETE FROM tutor_sessions WHERE session_id = ?", (session_id,))
+
+
+class RedisSessionBackend:
+    """
+    Sessions in Redis (one hash per session), shared across hosts.
+    Each save is one MULTI/EXEC round trip; idle sessions expire on their own.
+    `client` can be any redis-py compatible client (e.g. a local stand-in).
+    """
+
+    def __init__(self, client=None, url=REDIS_URL, idle_ttl=TUTOR_SESSION_IDLE_TTL,
+                 prefix="deepblue:session:"):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("TUTOR_SESSION_BACKEND=redis needs the 'redis' package.")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.idle_ttl = int(idle_ttl)
+        self.prefix = prefix
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def version(self, session_id):
+        version = self.client.hget(self._key(session_id), "version")
+        return int(version) if version is not None else None
+
+    def load(self, session_id):
+        version, state = self.client.hmget(self._key(session_id), ["version", "state"])
+        if version is None or state is None:
+            return None
+        return int(version), json.loads(state)
+
+    def save(self, session_id, state):
+        key = self._key(session_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hincrby(key, "version", 1)
+        pipe.hset(key, "state", json.dumps(state, separators=(",", ":")))
+        pipe.expire(key, self.idle_ttl)
+        version, _, _ = pipe.execute()
+        return int(version)
+
+    def delete(self, session_id):
+        self.client.delete(self._key(session_id))
+
+
+def make_session_backend(kind=TUTOR_SESSION_BACKEND):
+    """Backend named by TUTOR_SESSION_BACKEND, or None for process-local sessions."""
+    kind = (kind or "memory").lower()
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        return SQLiteSessionBackend()
+    if kind == "redis":
+        return RedisSessionBackend()
+    raise ValueError(f"Unknown TUTOR_SESSION_BACKEND '{kind}' (use memory, sqlite or redis).")
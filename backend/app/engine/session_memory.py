@@ -0,0 +1,275 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import HumanMessage, SystemMessage, messages_from_dict, messages_to_dict
+
+# --- MEMORY CONFIG (overridable from .env) ---
+TUTOR_MAX_SESSIONS = int(os.getenv("TUTOR_MAX_SESSIONS", "1000"))
+TUTOR_SESSION_IDLE_TTL = float(os.getenv("TUTOR_SESSION_IDLE_TTL", "3600"))
+TUTOR_HISTORY_TOKEN_BUDGET = int(os.getenv("TUTOR_HISTORY_TOKEN_BUDGET", "1500"))
+
+# Marker the tutor puts in front of a full snapshot of the student's code
+CODE_MARKER = "[STUDENT'S CODE]:"
+# ...and in front of a diff against the code it sent before (see prompt_builder)
+DIFF_MARKER = "[STUDENT'S CODE CHANGES]:"
+OMITTED_CODE = f"{CODE_MARKER} (older snapshot omitted)"
+
+# How many dropped questions the running summary remembers
+SUMMARY_POINTS = 5
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return len(text) // 4 + 4
+
+
+def split_question(content: str) -> str:
+    """The student's question of a human turn, without the code part."""
+    for marker in (CODE_MARKER, DIFF_MARKER):
+        content = content.split(marker, 1)[0]
+    return content.strip()
+
+
+def _has_code(message):
+    return isinstance(message, HumanMessage) and (CODE_MARKER in message.content or DIFF_MARKER in message.content)
+
+
+def _is_snapshot(message):
+    return (isinstance(message, HumanMessage) and CODE_MARKER in message.content
+            and not message.content.endswith(OMITTED_CODE))
+
+
+class WindowedChatHistory(BaseChatMessageHistory):
+    """
+    Chat history with a fixed token budget.
+    Only the newest code snapshot (and the diffs sent after it) is kept verbatim,
+    and the oldest turns are folded into a one-line summary once the budget is exceeded.
+    Also remembers the code the tutor last saw, so the next turn can send a diff.
+    """
+
+    def __init__(self, max_tokens: int = TUTOR_HISTORY_TOKEN_BUDGET):
+        self.max_tokens = max_tokens
+        self.turns = []
+        self.dropped_turns = 0
+        self.summary_points = []
+        self.last_code = None  # code as of the newest human turn; None = send a full snapshot next
+        self.diff_turns = 0  # diff-only turns since the last snapshot
+        self._expected = {}  # human turn content -> (code, snapshot), until the turn is stored
+
+    @property
+    def messages(self):
+        if not self.dropped_turns:
+            return list(self.turns)
+        summary = (
+            f"[SESSION SUMMARY] {self.dropped_turns} earlier turn(s) omitted. "
+            f"Earlier the student asked about: {'; '.join(self.summary_points) or 'their code'}."
+        )
+        return [SystemMessage(content=summary)] + self.turns
+
+    def add_messages(self, messages):
+        for message in messages:
+            if isinstance(message, HumanMessage) and message.content in self._expected:
+                self.last_code, snapshot = self._expected.pop(message.content)
+                self.diff_turns = 0 if snapshot else self.diff_turns + 1
+        self.turns.extend(messages)
+        self._compact()
+
+    def code_context(self):
+        """(last code the tutor saw, diff turns since the last snapshot); None when there's no diff base left."""
+        if not any(_is_snapshot(m) for m in self.turns):
+            return None, 0
+        return self.last_code, self.diff_turns
+
+    def expect_code(self, content: str, code, snapshot: bool):
+        """Registers the code behind a human turn; it becomes last_code once that turn is stored."""
+        self._expected[content] = (code, snapshot)
+        while len(self._expected) > 8:  # turns whose LLM call failed are never stored
+            self._expected.pop(next(iter(self._expected)))
+
+    async def aget_messages(self):
+        return self.messages
+
+    async def aadd_messages(self, messages):
+        self.add_messages(messages)
+
+    def clear(self):
+        self.turns = []
+        self.dropped_turns = 0
+        self.summary_points = []
+        self.last_code = None
+        self.diff_turns = 0
+
+    async def aclear(self):
+        self.clear()
+
+    def to_state(self):
+        """JSON-serializable snapshot, for shared session backends."""
+        return {
+            "turns": messages_to_dict(self.turns),
+            "dropped_turns": self.dropped_turns,
+            "summary_points": self.summary_points,
+            "last_code": self.last_code,
+            "diff_turns": self.diff_turns,
+        }
+
+    def load_state(self, state):
+        self.turns = messages_from_dict(state["turns"])
+        self.dropped_turns = state["dropped_turns"]
+        self.summary_points = state["summary_points"]
+        # States saved before code diffs existed have neither
+        self.last_code = state.get("last_code")
+        self.diff_turns = state.get("diff_turns", 0)
+
+    def _strip_old_code(self):
+        code_turns = [i for i, m in enumerate(self.turns) if _has_code(m)]
+        if not code_turns:
+            return
+        # Diffs only make sense on top of the snapshot before them
+        snapshots = [i for i in code_turns if _is_snapshot(self.turns[i])]
+        keep_from = snapshots[-1] if snapshots else code_turns[-1]
+        for i in code_turns:
+            if i >= keep_from:
+                break
+            content = self.turns[i].content
+            if not content.endswith(OMITTED_CODE):
+                question = split_question(content)
+                stripped = f"{question}\n\n{OMITTED_CODE}" if question else OMITTED_CODE
+                self.turns[i] = HumanMessage(content=stripped)
+
+    def _summarize(self, message):
+        if not isinstance(message, HumanMessage):
+            return
+        self.dropped_turns += 1
+        question = split_question(message.content)
+        if question:
+            self.summary_points.append(question[:80])
+            self.summary_points = self.summary_points[-SUMMARY_POINTS:]
+
+    def _compact(self):
+        self._strip_old_code()
+        total = sum(estimate_tokens(m.content) for m in self.turns)
+        # Always keep the latest exchange, even if it alone is over budget
+        while total > self.max_tokens and len(self.turns) > 2:
+            dropped = self.turns.pop(0)
+            total -= estimate_tokens(dropped.content)
+            self._summarize(dropped)
+            # Drop whole exchanges so the window never opens on a dangling reply
+            while len(self.turns) > 2 and not isinstance(self.turns[0], HumanMessage):
+                total -= estimate_tokens(self.turns.pop(0).content)
+
+
+class PersistentChatHistory(WindowedChatHistory):
+    """
+    WindowedChatHistory whose state lives in a shared backend (see session_backends),
+    so any API worker can continue any conversation.
+    The loaded state doubles as a read cache: each read only asks the backend for the
+    session's version and re-fetches the state when another worker has moved it on.
+    Each exchange is written back in a single batched save.
+    """
+
+    def __init__(self, session_id: str, backend, max_tokens: int = TUTOR_HISTORY_TOKEN_BUDGET):
+        super().__init__(max_tokens)
+        self.session_id = session_id
+        self.backend = backend
+        self.version = None  # backend version of the state we hold; None = nothing stored
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        version = self.backend.version(self.session_id)
+        if version == self.version:
+            return
+        loaded = self.backend.load(self.session_id) if version is not None else None
+        if loaded is None:
+            WindowedChatHistory.clear(self)
+            self.version = None
+        else:
+            self.version, state = loaded
+            self.load_state(state)
+
+    @property
+    def messages(self):
+        with self._lock:
+            self._refresh()
+            return WindowedChatHistory.messages.fget(self)
+
+    def code_context(self):
+        with self._lock:
+            self._refresh()
+            return WindowedChatHistory.code_context(self)
+
+    def add_messages(self, messages):
+        with self._lock:
+            # Start from the newest state so a turn taken on another worker isn't overwritten
+            self._refresh()
+            WindowedChatHistory.add_messages(self, messages)
+            self.version = self.backend.save(self.session_id, self.to_state())
+
+    def clear(self):
+        with self._lock:
+            WindowedChatHistory.clear(self)
+            self.backend.delete(self.session_id)
+            self.version = None
+
+    # Backends do blocking I/O, so the async variants run on the default executor
+    async def aget_messages(self):
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.messages)
+
+    async def aadd_messages(self, messages):
+        await asyncio.get_running_loop().run_in_executor(None, self.add_messages, messages)
+
+    async def aclear(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.clear)
+
+
+class SessionStore:
+    """
+    session_id -> chat history, capped by count (LRU) and by idle time.
+    With a shared `backend` the histories here are only a per-process read cache,
+    so evicting one loses nothing.
+    """
+
+    def __init__(self, max_sessions=TUTOR_MAX_SESSIONS, idle_ttl=TUTOR_SESSION_IDLE_TTL,
+                 history_factory=WindowedChatHistory, backend=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.history_factory = history_factory
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id -> (history, last_used)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def __getitem__(self, session_id):
+        return self._sessions[session_id][0]
+
+    def get(self, session_id: str):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._sessions.pop(session_id, None)
+            history = entry[0] if entry else self._new_history(session_id)
+            self._sessions[session_id] = (history, now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return history
+
+    def _new_history(self, session_id):
+        if self.backend is not None:
+            return PersistentChatHistory(session_id, self.backend)
+        return self.history_factory()
+
+    def _evict_idle(self, now):
+        # Least recently used sessions sit at the front
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if now - self._sessions[oldest][1] <= self.idle_ttl:
+                break
+            del self._sessions[oldest]
@@ -0,0 +1,152 @@
+import os
+import re
+import ast
+import time
+import queue
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from collections import OrderedDict
+
+# --- CACHE CONFIG (overridable from .env) ---
+TUTOR_CACHE_PATH = os.getenv("TUTOR_CACHE_PATH", "./tutor_cache.db")
+TUTOR_CACHE_MAX_ENTRIES = int(os.getenv("TUTOR_CACHE_MAX_ENTRIES", "5000"))
+TUTOR_CACHE_TTL = float(os.getenv("TUTOR_CACHE_TTL", str(24 * 3600)))
+
+
+def normalize_code(code: str, tree=None) -> str:
+    """
+    Formatting- and comment-insensitive form of the code.
+    Valid Python becomes its ast.dump(); anything else (or code too deep to dump) falls back
+    to collapsed whitespace.
+    `tree` is an optional, already parsed AST of `code`.
+    """
+    try:
+        return ast.dump(tree if tree is not None else ast.parse(code))
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return re.sub(r"\s+", " ", code).strip()
+
+
+def make_cache_key(code: str, objective: str, question: str, tree=None) -> str:
+    h = hashlib.sha256()
+    for part in (normalize_code(code, tree), objective, question):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class TutorCache:
+    """
+    LRU + TTL cache of tutor replies.
+    Lookups and inserts only touch memory; a background writer thread applies the
+    changes to SQLite in batches, which keeps the entries across restarts.
+    """
+
+    def __init__(self, path=TUTOR_CACHE_PATH, max_entries=TUTOR_CACHE_MAX_ENTRIES, ttl=TUTOR_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (response, created_at)
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tutor_cache ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._load()
+
+        # Write-behind: (sql, params) statements, applied in order by one thread
+        self._writes = queue.Queue()
+        threading.Thread(target=self._write_loop, name="tutor-cache-writer", daemon=True).start()
+
+    def _load(self):
+        cutoff = time.time() - self.ttl
+        self._db.execute("DELETE FROM tutor_cache WHERE created_at < ?", (cutoff,))
+        rows = self._db.execute(
+            "SELECT key, response, created_at FROM tutor_cache ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        # Oldest first, so the newest entries end up most-recently-used
+        for key, response, created_at in reversed(rows):
+            self._entries[key] = (response, created_at)
+
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            # Everything queued meanwhile goes into the same transaction
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._db.execute("BEGIN")
+                for sql, params in batch:
+                    self._db.execute(sql, params)
+                self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                print(f"⚠️ Tutor cache write failed: {e}")
+                with contextlib.suppress(sqlite3.Error):
+                    self._db.execute("ROLLBACK")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def _write(self, sql, params=()):
+        self._writes.put((sql, params))
+
+    def flush(self):
+        """Waits until every queued write has reached SQLite."""
+        self._writes.join()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                self._write("DELETE FROM tutor_cache WHERE key = ?", (key,))
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, response):
+        if not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (response, now)
+            self._entries.move_to_end(key)
+            self._write(
+                "INSERT OR REPLACE INTO tutor_cache (key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, now),
+            )
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._write("DELETE FROM tutor_cache WHERE key = ?", (old_key,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._write("DELETE FROM tutor_cache")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+        }
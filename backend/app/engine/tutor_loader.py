@@ -0,0 +1,115 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from app.metrics import registry, stage
+
+# --- TUTOR STARTUP CONFIG (overridable from .env) ---
+# Build the tutor in the background right after startup instead of on the first /analyze
+TUTOR_WARMUP = os.getenv("TUTOR_WARMUP", "1") != "0"
+# After a failed build (no API key, import error...), wait this long before trying again
+TUTOR_RETRY_INTERVAL = float(os.getenv("TUTOR_RETRY_INTERVAL", "30.0"))
+
+
+class TutorUnavailable(Exception):
+    """Raised when the AI tutor could not be built; the rest of the API keeps working."""
+
+
+def _build_socratic_ai():
+    # LangChain and the Gemini client are only imported here, never at API import time
+    from app.engine.rag_agent import SocraticAI
+    return SocraticAI()
+
+
+class TutorLoader:
+    """
+    Builds the SocraticAI tutor once, on a background thread, on first use or warm-up.
+    Concurrent callers share the same build; failures are remembered for
+    `retry_interval` seconds so a missing key doesn't cost every request a rebuild.
+    """
+
+    def __init__(self, factory=_build_socratic_ai, retry_interval=TUTOR_RETRY_INTERVAL):
+        self.factory = factory
+        self.retry_interval = retry_interval
+        self._tutor = None
+        self._error = None
+        self._failed_at = 0.0
+        self._loading = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """One of "ready", "loading", "unavailable" or "cold" (not requested yet)."""
+        if self._tutor is not None:
+            return "ready"
+        if self._loading is not None:
+            return "loading"
+        if self._error is not None:
+            return "unavailable"
+        return "cold"
+
+    @property
+    def error(self):
+        return None if self._error is None else str(self._error)
+
+    def peek(self):
+        """The tutor if it is already built, else None. Never triggers a build."""
+        return self._tutor
+
+    def _check_backoff(self):
+        if self._error is not None and time.monotonic() - self._failed_at < self.retry_interval:
+            raise TutorUnavailable(f"The AI tutor is unavailable: {self._error}")
+
+    def _start_loading(self) -> Future:
+        with self._lock:
+            if self._loading is None:
+                self._loading = Future()
+                threading.Thread(
+                    target=self._load, args=(self._loading,), name="tutor-loader", daemon=True
+                ).start()
+            return self._loading
+
+    def _load(self, future):
+        try:
+            with stage("tutor.init"):
+                tutor = self.factory()
+        except Exception as e:
+            print(f"⚠️ AI tutor unavailable: {e}")
+            self._error, self._failed_at = e, time.monotonic()
+            future.set_exception(TutorUnavailable(f"The AI tutor is unavailable: {e}"))
+        else:
+            self._tutor, self._error = tutor, None
+            future.set_result(tutor)
+        finally:
+            with self._lock:
+                self._loading = None
+
+    def warm_up(self):
+        """Starts building in the background without waiting for it."""
+        if self._tutor is None and self._error is None:
+            self._start_loading()
+
+    async def get(self):
+        """The tutor, building it first if needed. Raises TutorUnavailable."""
+        if self._tutor is not None:
+            return self._tutor
+        self._check_backoff()
+        return await asyncio.wrap_future(self._start_loading())
+
+    def get_blocking(self):
+        """Same as get(), for scripts outside the event loop."""
+        if self._tutor is not None:
+            return self._tutor
+        self._check_backoff()
+        return self._start_loading().result()
+
+
+tutor_loader = TutorLoader()
+
+registry.gauge(
+    "deepblue_tutor_sessions", "Tutor sessions held in memory.",
+    lambda: len(tutor_loader.peek().store) if tutor_loader.peek() else 0,
+)
+registry.gauge("deepblue_tutor_ready", "1 once the AI tutor is built and usable.", lambda: int(tutor_loader.state == "ready"))
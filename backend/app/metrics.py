@@ -0,0 +1,243 @@
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+
+# Seconds; spans sub-millisecond AST parses up to multi-second LLM calls
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Clients send this request header to get a Server-Timing breakdown back
+TIMING_HEADER = "x-debug-timing"
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# --- METRIC TYPES ---
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Gauge:
+    """Read at scrape time from a callback, so it never drifts from the real value."""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def collect(self):
+        try:
+            value = self.read()
+        except Exception:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics in the Prometheus text format.
+    With several uvicorn workers each process is scraped (or exposes) its own numbers.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, read):
+        return self._register(Gauge(name, help_text, read))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "deepblue_stage_seconds", "Time spent per request stage.", labels=("stage",)
+)
+REQUEST_SECONDS = registry.histogram(
+    "deepblue_http_request_seconds", "HTTP request latency, including streamed bodies.", labels=("method", "route")
+)
+REQUESTS_TOTAL = registry.counter(
+    "deepblue_http_requests_total", "HTTP requests by route and status.", labels=("method", "route", "status")
+)
+SANDBOX_EVENTS = registry.counter(
+    "deepblue_sandbox_events_total", "Sandbox timeouts, memory-limit hits, crashes, busy rejections and worker respawns.", labels=("event",)
+)
+SANDBOX_CPU_SECONDS = registry.histogram(
+    "deepblue_sandbox_cpu_seconds", "CPU time used per sandbox execution.",
+)
+SANDBOX_PEAK_RSS_BYTES = registry.histogram(
+    "deepblue_sandbox_peak_rss_bytes", "Peak resident memory per sandbox execution.",
+    buckets=tuple(mb * 1024 * 1024 for mb in (16, 32, 64, 128, 256, 512, 1024)),
+)
+LLM_ERRORS = registry.counter(
+    "deepblue_llm_errors_total", "Failed tutor LLM calls by exception type.", labels=("error",)
+)
+TUTOR_COALESCED = registry.counter(
+    "deepblue_tutor_coalesced_total", "Tutor requests that joined an identical call or were superseded.", labels=("outcome",)
+)
+CACHE_LOOKUPS = registry.counter(
+    "deepblue_cache_lookups_total", "Cache lookups by cache and result (hit/miss).", labels=("cache", "result")
+)
+
+
+# --- PER-REQUEST TRACE ---
+
+# (stage, seconds) pairs for the current request; None outside of a request
+_trace = contextvars.ContextVar("deepblue_request_trace", default=None)
+
+def record_stage(name, seconds):
+    """Records a stage timed elsewhere (e.g. inside a sandbox worker)."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+@contextlib.contextmanager
+def stage(name):
+    """Times the block into deepblue_stage_seconds and the current request's trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+def count_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+def server_timing(trace, total):
+    """Server-Timing header value; repeated stages are summed."""
+    totals = {}
+    for name, seconds in trace:
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class RequestTimingMiddleware:
+    """
+    Plain ASGI middleware (no response buffering, so SSE streams are untouched).
+    Records request latency per route and, when the client sends X-Debug-Timing,
+    adds a Server-Timing header with the stages that ran before the response started.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = []
+        token = _trace.set(trace)
+        wants_timing = any(name == TIMING_HEADER.encode("latin-1") for name, _ in scope["headers"])
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if wants_timing:
+                    value = server_timing(trace, time.perf_counter() - started)
+                    headers = list(message.get("headers", [])) + [(b"server-timing", value.encode("latin-1"))]
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+            # Route templates, not raw paths, so label cardinality stays bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "")
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, route=route)
+            REQUESTS_TOTAL.inc(method=method, route=route, status=str(status))
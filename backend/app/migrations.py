@@ -0,0 +1,26 @@
+from sqlalchemy import text
+
+from .database import engine, Base
+from . import models  # noqa: F401  (registers the tables on Base)
+
+
+async def _dedupe_progress(conn):
+    """
+    Older deepblue.db files could hold several rows per (user_id, mission_id).
+    Keep the newest one so the unique index can be created.
+    """
+    await conn.execute(text(
+        "DELETE FROM user_progress WHERE id NOT IN ("
+        "SELECT MAX(id) FROM user_progress GROUP BY user_id, mission_id)"
+    ))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_user_progress_user_mission "
+        "ON user_progress (user_id, mission_id)"
+    ))
+
+
+async def init_db():
+    """Creates missing tables, then brings existing databases up to the current schema."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await _dedupe_progress(conn)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -12,6 +12,10 @@ class User(Base):
 
 class UserProgress(Base):
     __tablename__ = "user_progress"
+    # One row per (user, mission); progress writes upsert against this
+    __table_args__ = (
+        Index("ix_user_progress_user_mission", "user_id", "mission_id", unique=True),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     mission_id = Column(Integer)
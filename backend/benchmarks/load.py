@@ -0,0 +1,145 @@
+"""
+Load generator for the API endpoints.
+
+In-process (default): the app runs inside this process on a temp database,
+with Gemini replaced by the local fake model.
+
+    cd backend && python -m benchmarks.load --concurrency 1 10 50 --out load.json
+
+Against a running server (start it with TUTOR_FAKE_LLM=1 to stay offline, and run
+this with the same SESSION_SECRET so /save-progress accepts the benchmark's tokens):
+
+    SESSION_SECRET=... python -m benchmarks.load --url http://127.0.0.1:8000
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+import httpx
+
+from benchmarks.stats import summarize, write_report
+
+ENDPOINTS = ["execute", "analyze", "missions", "register", "save-progress"]
+
+SOLUTION = "def activate_nitro(speed):\n    return speed * 2"
+
+
+def build_request(endpoint, i, run_id):
+    """(method, url, kwargs) for the i-th request to an endpoint."""
+    if endpoint == "execute":
+        # A different constant per request, so the grading cache can't answer and every run hits a sandbox
+        code = f"{SOLUTION}\n\nbench_request = {i}"
+        return "POST", "/execute", {"json": {"code": code, "mission_id": 103}}
+    if endpoint == "analyze":
+        # Vary the code so the tutor cache doesn't answer everything
+        code = f"def activate_nitro(speed):\n    return speed * {i}"
+        return "POST", "/analyze", {"json": {
+            "code": code, "user_input": "Analyze this logic",
+            "session_id": f"bench-{run_id}-{i % 50}", "is_premium": True,
+        }}
+    if endpoint == "missions":
+        return "GET", "/missions", {"params": {"is_premium": "true"}}
+    if endpoint == "register":
+        return "POST", "/register", {"json": {"username": f"bench_{run_id}_{i}", "password": "benchmark"}}
+    if endpoint == "save-progress":
+        # Imported here: app.auth reads SESSION_SECRET, which in_process_client sets first
+        from app.auth import create_session_token
+        user_id = i % 100 + 1
+        return "POST", "/save-progress", {
+            "params": {"user_id": user_id, "mission_id": 103, "code": SOLUTION},
+            "headers": {"Authorization": f"Bearer {create_session_token(user_id, f'bench_{user_id}')}"},
+        }
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+async def drive(client, endpoint, concurrency, total, run_id, offset=0):
+    latencies, errors = [], 0
+    # Request numbers never repeat within a run, so usernames and tutor inputs stay unique
+    counter = iter(range(offset, offset + total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs = build_request(endpoint, i, run_id)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, wall_s=time.perf_counter() - started, errors=errors)
+
+
+@contextlib.asynccontextmanager
+async def in_process_client(llm_latency, token_delay):
+    tmp = tempfile.mkdtemp(prefix="deepblue-bench-")
+    os.environ.setdefault("TUTOR_FAKE_LLM", "1")
+    os.environ.setdefault("TUTOR_FAKE_LLM_LATENCY", str(llm_latency))
+    os.environ.setdefault("TUTOR_FAKE_LLM_TOKEN_DELAY", str(token_delay))
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tmp}/bench.db")
+    os.environ.setdefault("TUTOR_CACHE_PATH", f"{tmp}/tutor_cache.db")
+    os.environ.setdefault("SESSION_SECRET", "benchmark")
+
+    from main import app  # imported late so the env above applies
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+
+@contextlib.asynccontextmanager
+async def remote_client(url):
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        yield client
+
+
+async def run(args):
+    run_id = uuid.uuid4().hex[:8]
+    results = {}
+    client_cm = remote_client(args.url) if args.url else in_process_client(args.llm_latency, args.llm_token_delay)
+    async with client_cm as client:
+        for endpoint in args.endpoints:
+            for level, concurrency in enumerate(args.concurrency):
+                print(f"🚀 {endpoint} @ concurrency {concurrency} ...")
+                results[f"{endpoint}@{concurrency}"] = await drive(
+                    client, endpoint, concurrency, args.requests, run_id, offset=level * args.requests
+                )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deep Blue load generator")
+    parser.add_argument("--url", help="Base URL of a running server (default: in-process app)")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake tutor time-to-first-token (s)")
+    parser.add_argument("--llm-token-delay", type=float, default=0.01, help="Fake tutor delay between tokens (s)")
+    parser.add_argument("--out", default="load_results.json", help="JSON output path ('-' for stdout)")
+    args = parser.parse_args()
+
+    # stdout is reserved for the report with --out -; progress (and anything the app prints) goes to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run(args))
+    write_report("load", results, args.out, params={
+        "url": args.url or "in-process",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "llm_latency": args.llm_latency,
+        "llm_token_delay": args.llm_token_delay,
+    })
+
+
+if __name__ == "__main__":
+    main()
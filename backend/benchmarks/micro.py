@@ -0,0 +1,123 @@
+"""
+Micro-benchmarks for backend hot paths.
+
+    cd backend && python -m benchmarks.micro --out micro.json
+"""
+import sys
+import time
+import random
+import argparse
+import contextlib
+
+from benchmarks.stats import summarize, write_report
+
+
+def make_program(functions, statements):
+    """Synthetic student program: `functions` defs with `statements` loop/if/assign blocks each."""
+    blocks = []
+    for f in range(functions):
+        body = []
+        for s in range(statements):
+            body.append(
+                f"    total_{s} = helper(x, {s})\n"
+                f"    for i in range({s} + 2):\n"
+                f"        if i % 2 == 0:\n"
+                f"            print(i, total_{s})"
+            )
+        blocks.append(f"def func_{f}(x):\n" + "\n".join(body) + "\n    return x")
+    return "\n\n".join(blocks)
+
+
+PROGRAMS = {
+    "small": "def activate_nitro(speed):\n    boost = speed * 2\n    if boost > 100:\n        print(boost)\n    return boost",
+    "medium": make_program(10, 8),   # ~330 lines
+    "huge": make_program(120, 40),   # ~19k lines
+}
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def bench_parse(repeat):
+    from app.engine import ast_parser
+    results = {}
+    for name, code in PROGRAMS.items():
+        n = max(3, repeat // (20 if name == "huge" else 1))
+
+        def cold():
+            ast_parser._parse_cache.clear()
+            ast_parser.parse_code_to_3d(code, ast_parser.LOD_NODE_BUDGET)
+
+        results[f"parse_code_to_3d[{name}]"] = summarize(timed(cold, n))
+        results[f"parse_code_to_3d[{name},cached]"] = summarize(
+            timed(lambda: ast_parser.parse_code_to_3d(code, ast_parser.LOD_NODE_BUDGET), n)
+        )
+        results[f"parse_code_to_3d[{name}]"]["lines"] = code.count("\n") + 1
+    return results
+
+
+def bench_missions(repeat):
+    from app.catalog import mission_catalog
+    ids = [m["id"] for m in mission_catalog.list(is_premium=True)]
+    batch = 1000
+
+    def lookups():
+        for mission_id in random.choices(ids, k=batch):
+            mission_catalog.get(mission_id)
+
+    result = summarize([t / batch for t in timed(lookups, repeat)])
+    result["batch"] = batch
+    return {
+        "mission_catalog.get": result,
+        "mission_catalog.rendered[premium]": summarize(
+            timed(lambda: mission_catalog.rendered(True), repeat)
+        ),
+    }
+
+
+def bench_sandbox(repeat):
+    from app.engine.executor import execute_code_safely, sandbox_pool
+    from app.catalog import mission_catalog
+
+    sandbox_pool.start()
+    mission = mission_catalog.get(103)
+    solution = "def activate_nitro(speed):\n    return speed * 2"
+    try:
+        return {
+            "execute_code_safely[print]": summarize(
+                timed(lambda: execute_code_safely("print('hello')"), repeat)
+            ),
+            "execute_code_safely[graded]": summarize(
+                timed(lambda: execute_code_safely(solution, test_cases=mission["test_cases"]), repeat)
+            ),
+        }
+    finally:
+        sandbox_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deep Blue micro-benchmarks")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--only", choices=["parse", "missions", "sandbox"], action="append")
+    parser.add_argument("--out", default="micro_results.json", help="JSON output path ('-' for stdout)")
+    args = parser.parse_args()
+
+    suites = {"parse": bench_parse, "missions": bench_missions, "sandbox": bench_sandbox}
+    results = {}
+    # stdout is reserved for the report with --out -; progress (and anything the app prints) goes to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        for name in args.only or suites:
+            print(f"⏱️ Running {name} ...")
+            results.update(suites[name](args.repeat))
+
+    write_report("micro", results, args.out, params={"repeat": args.repeat})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import time
+import platform
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies_s, wall_s=None, errors=0):
+    """Latency percentiles (ms) and throughput for one benchmark case."""
+    values = sorted(latencies_s)
+    n = len(values)
+    total = wall_s if wall_s is not None else sum(values)
+    return {
+        "count": n,
+        "errors": errors,
+        "mean_ms": round(sum(values) / n * 1000, 6) if n else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 6),
+        "p95_ms": round(percentile(values, 95) * 1000, 6),
+        "p99_ms": round(percentile(values, 99) * 1000, 6),
+        "max_ms": round(values[-1] * 1000, 6) if n else 0.0,
+        "throughput_per_s": round(n / total, 2) if total else 0.0,
+    }
+
+
+def write_report(kind, results, path, params=None):
+    report = {
+        "kind": kind,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params or {},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if path == "-":
+        print(text)
+    else:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+        print(f"📊 Wrote {kind} results to {path}", file=sys.stderr)
+    return report
@@ -1,30 +1,67 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Response
 from pydantic import BaseModel
+from typing import List
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-import json
-import os
-import io
-import contextlib
-import traceback
-import re
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+from dotenv import load_dotenv
+
+# .env must be loaded before the app modules read their config
+load_dotenv()
 
 # --- INTERNAL IMPORTS ---
-from app.engine.rag_agent import ai_tutor
-from app.engine.ast_parser import parse_code_to_3d
+# (the AI tutor and LangChain are loaded lazily by tutor_loader, not at import time)
+from app.engine.tutor_loader import tutor_loader, TutorUnavailable, TUTOR_WARMUP
+from app.engine.coalescer import tutor_coalescer, Superseded
+from app.engine.ast_parser import parse_code_to_3d, LOD_NODE_BUDGET, LOD_MAX_NODES
+from app.engine.graph_delta import graph_tracker
+from app.engine.graph_codec import (
+    negotiate_format, encode_columnar, dumps_json, dumps_msgpack, COLUMNAR_MEDIA_TYPE,
+)
+from app.engine.executor import sandbox_pool, SandboxBusy
+from app.engine.preflight import PreflightError
+from app.engine.grader import (
+    grade_submission, stream_grading, prepare_submission, run_grading, stream_job, sse_event,
+)
+from app.catalog import mission_catalog
+from app.metrics import registry, stage, RequestTimingMiddleware, PROMETHEUS_MEDIA_TYPE
 
 # --- DATABASE IMPORTS ---
-from app.database import engine, get_db
+from app.database import engine, get_db, check_database, SessionLocal
+from app.migrations import init_db
+from app.auth import password_hasher, AuthBusy, create_session_token, bearer_claims
 from app import models
 
-# Initialize Database Tables
-models.Base.metadata.create_all(bind=engine)
+app = FastAPI()
+
+@app.on_event("startup")
+async def prepare_database():
+    # Create tables and migrate older deepblue.db files (dedupe + unique progress index)
+    await init_db()
 
-# Password Hashing Config
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@app.on_event("shutdown")
+async def close_database():
+    await engine.dispose()
+    password_hasher.shutdown()
 
-app = FastAPI()
+@app.on_event("startup")
+def start_sandboxes():
+    # Pre-fork the sandbox workers so the first /execute doesn't pay for it
+    sandbox_pool.start()
+
+@app.on_event("shutdown")
+def stop_sandboxes():
+    sandbox_pool.shutdown()
+
+@app.on_event("startup")
+def warm_up_tutor():
+    # Builds LangChain + Gemini on a background thread; startup doesn't wait for it
+    if TUTOR_WARMUP:
+        tutor_loader.warm_up()
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,223 +69,558 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Per-route latency for /metrics; Server-Timing breakdown for requests sent with X-Debug-Timing
+app.add_middleware(RequestTimingMiddleware)
+
 # --- REQUEST MODELS ---
 class UserAuth(BaseModel):
     username: str
     password: str
 
+DEFAULT_SESSION = "default_user"
+
 class CodeRequest(BaseModel):
     code: str
     user_input: str = ""
-    session_id: str = "default_user"
+    session_id: str = DEFAULT_SESSION
     is_premium: bool = False
     mission_id: int = None
     user_id: int = None 
+    fail_fast: bool = False
+    visual_mode: str = "full"  # "full" or "delta"
+    graph_version: str = None  # version (content hash) of the graph the client already holds (delta mode)
+    max_nodes: int = None  # level-of-detail node budget (server default if unset)
+    expand: List[int] = []  # collapsed node IDs the client wants opened
+    analyze: bool = True  # /submit: also ask the tutor
 
 # --- HELPER FUNCTIONS ---
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Details of why are on /readyz; students just get this
+TUTOR_OFFLINE = "AI Error: The tutor is offline right now. Visuals and tests still work."
+SUPERSEDED = "Skipped: a newer analysis for this session replaced this one."
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def session_user_id(authorization: str = Header(None)):
+    """Dependency: id of the user whose Bearer token came with the request, or None."""
+    claims = bearer_claims(authorization)
+    return claims.get("uid") if claims else None
+
+def require_user(session_uid, user_id):
+    """Anything done on behalf of `user_id` needs that user's session token."""
+    if session_uid is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+    if session_uid != user_id:
+        raise HTTPException(status_code=403, detail="This session belongs to another user")
 
 @app.get("/")
 def read_root():
     return {"status": "Deep Blue API is running 🔵"}
 
+@app.get("/healthz")
+def liveness():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readiness(response: Response):
+    """
+    Readiness: the database answers and the sandboxes are started.
+    The tutor's state is reported but doesn't gate readiness; without it
+    /analyze still returns visuals with an "AI Error" message.
+    """
+    checks = {"sandbox": "ok" if sandbox_pool.started else "starting"}
+    try:
+        await check_database()
+        checks["database"] = "ok"
+    except Exception as e:
+        checks["database"] = f"error: {e}"
+    checks["tutor"] = tutor_loader.state
+    if tutor_loader.error:
+        checks["tutor_error"] = tutor_loader.error
+
+    ready = checks["database"] == "ok" and checks["sandbox"] == "ok"
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "checks": checks}
+
 # --- DATABASE ENDPOINTS ---
 
 @app.post("/register")
-def register_user(auth: UserAuth, db: Session = Depends(get_db)):
+async def register_user(auth: UserAuth, db: AsyncSession = Depends(get_db), authorization: str = Header(None)):
     """
     Registers a new user with password or logs in an existing one.
+    Both return a signed session token; sending it back as a Bearer token skips bcrypt.
     """
     username = auth.username
     password = auth.password
     
-    existing = db.query(models.User).filter(models.User.username == username).first()
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    existing = result.scalars().first()
     
     # 1. Login Existing User
     if existing:
-        if not verify_password(password, existing.hashed_password):
-            raise HTTPException(status_code=401, detail="Incorrect password")
+        claims = bearer_claims(authorization)
+        if not (claims and claims.get("uid") == existing.id):
+            try:
+                with stage("auth.verify"):
+                    password_ok = await password_hasher.verify(password, existing.hashed_password)
+            except AuthBusy as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            if not password_ok:
+                raise HTTPException(status_code=401, detail="Incorrect password")
             
         # Auto-upgrade 'pro' user if needed (legacy support)
         if username.lower() == "pro" and not existing.is_premium:
             existing.is_premium = True
-            db.commit()
+            await db.commit()
             
-        return {"message": "Login successful", "user_id": existing.id, "is_premium": existing.is_premium}
+        return {
+            "message": "Login successful",
+            "user_id": existing.id,
+            "is_premium": existing.is_premium,
+            "token": create_session_token(existing.id, existing.username)
+        }
     
     # 2. Register New User
-    hashed_pwd = get_password_hash(password)
+    try:
+        with stage("auth.hash"):
+            hashed_pwd = await password_hasher.hash(password)
+    except AuthBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
     # Auto-grant premium if username is 'pro'
     is_premium_status = True if username.lower() == "pro" else False
     
     new_user = models.User(username=username, hashed_password=hashed_pwd, is_premium=is_premium_status)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    with stage("db.commit"):
+        await db.commit()
+    await db.refresh(new_user)
     
-    return {"message": "Registration successful", "user_id": new_user.id, "is_premium": is_premium_status}
+    return {
+        "message": "Registration successful",
+        "user_id": new_user.id,
+        "is_premium": is_premium_status,
+        "token": create_session_token(new_user.id, new_user.username)
+    }
+
+@app.get("/session")
+async def get_session(db: AsyncSession = Depends(get_db), session_uid: int = Depends(session_user_id)):
+    """
+    Resumes a session from its Bearer token (no password, no bcrypt).
+    """
+    if session_uid is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+
+    user = await db.get(models.User, session_uid)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+
+    return {"user_id": user.id, "username": user.username, "is_premium": user.is_premium}
 
 @app.post("/upgrade-premium")
-def upgrade_premium(user_id: int, db: Session = Depends(get_db)):
+async def upgrade_premium(user_id: int, db: AsyncSession = Depends(get_db),
+                          session_uid: int = Depends(session_user_id)):
     """
     Upgrades a user to premium status.
     """
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    require_user(session_uid, user_id)
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     user.is_premium = True
-    db.commit()
+    await db.commit()
     return {"status": "User upgraded to Premium 🌟", "is_premium": True}
 
+async def upsert_progress(db: AsyncSession, user_id: int, mission_id: int, code: str):
+    """Marks a mission completed in one INSERT ... ON CONFLICT DO UPDATE statement."""
+    stmt = sqlite_insert(models.UserProgress).values(
+        user_id=user_id,
+        mission_id=mission_id,
+        is_completed=True,
+        code_solution=code
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "mission_id"],
+        set_={"is_completed": True, "code_solution": stmt.excluded.code_solution}
+    )
+    with stage("db.commit"):
+        await db.execute(stmt)
+        await db.commit()
+
 @app.post("/save-progress")
-def save_progress(user_id: int, mission_id: int, code: str, db: Session = Depends(get_db)):
-    existing = db.query(models.UserProgress).filter_by(user_id=user_id, mission_id=mission_id).first()
-    
-    if existing:
-        existing.code_solution = code
-        existing.is_completed = True
-    else:
-        progress = models.UserProgress(
-            user_id=user_id, 
-            mission_id=mission_id, 
-            is_completed=True, 
-            code_solution=code
-        )
-        db.add(progress)
-    
-    db.commit()
+async def save_progress(user_id: int, mission_id: int, code: str, db: AsyncSession = Depends(get_db),
+                        session_uid: int = Depends(session_user_id)):
+    require_user(session_uid, user_id)
+    await upsert_progress(db, user_id, mission_id, code)
     return {"status": "Mission Accomplished & Saved 💾"}
 
 # --- EXECUTION & TEST ENGINE ---
 
 @app.post("/execute")
 async def execute_code(request: CodeRequest):
-    # Security Filter
-    forbidden = ["import os", "import subprocess", "open(", "remove(", "rmdir"]
-    if any(bad in request.code for bad in forbidden):
-        return {"output": "⚠️ Security Alert: File system access is restricted."}
+    mission = mission_catalog.get(request.mission_id) if request.mission_id else None
 
-    output_buffer = io.StringIO()
+    # Pre-flighted (syntax + banned imports/calls) and compiled here, then run + graded on a warm sandbox worker in one round trip
     try:
-        with contextlib.redirect_stdout(output_buffer):
-            safe_globals = {"__builtins__": __builtins__}
-            exec(request.code, safe_globals)
-            
-            test_results = []
-            if request.mission_id:
-                try:
-                    with open(os.path.join("app", "data", "missions.json"), "r") as f:
-                        data = json.load(f)
-                    
-                    all_missions = []
-                    if isinstance(data, dict):
-                        for cat in data: 
-                            category_missions = data[cat] if isinstance(data[cat], list) else []
-                            for m in category_missions:
-                                if isinstance(m, dict):
-                                    all_missions.append(m)
-                    elif isinstance(data, list):
-                        all_missions = data
-
-                    mission = next((m for m in all_missions if m.get("id") == request.mission_id), None)
-
-                    if mission and "test_cases" in mission:
-                        match = re.search(r"def\s+(\w+)\(", request.code)
-                        if match:
-                            func_name = match.group(1)
-                            user_func = safe_globals.get(func_name)
-                            
-                            if user_func:
-                                for i, case in enumerate(mission["test_cases"]):
-                                    inputs = case["input"]
-                                    expected = case["expected"]
-                                    try:
-                                        result = user_func(*inputs)
-                                        passed = result == expected
-                                        test_results.append({
-                                            "id": i + 1,
-                                            "input": str(inputs),
-                                            "expected": str(expected),
-                                            "actual": str(result),
-                                            "passed": passed
-                                        })
-                                    except Exception as e:
-                                        test_results.append({"id": i+1, "passed": False, "actual": str(e)})
-                        else:
-                             test_results.append({"id": 0, "passed": False, "actual": "No function definition found."})
+        result = await grade_submission(request.code, mission, fail_fast=request.fail_fast)
+    except SandboxBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
-                except Exception as e:
-                    print(f"Test Runner Error: {e}")
+    return grading_response(result)
 
-        return {
-            "output": output_buffer.getvalue(),
-            "test_results": test_results
-        }
-    except Exception:
-        return {"output": traceback.format_exc()}
-    finally:
-        output_buffer.close()
+def grading_response(result):
+    # Measured CPU time, peak RSS and wall time of the run (absent if it never reached a worker)
+    usage = result.get("usage")
+    if not result["success"]:
+        return {"output": result["output"], "usage": usage}
+
+    return {
+        "output": result["output"],
+        "test_results": result["test_results"],
+        "usage": usage,
+        # True when this is a stored result of an equivalent submission; nothing was run
+        "cached": result.get("cached", False)
+    }
+
+@app.post("/execute/stream")
+async def execute_code_stream(request: CodeRequest):
+    """
+    Same as /execute, but as Server-Sent Events:
+    `output` events with stdout chunks while the program runs, one `case` event
+    per finished test case, then a final `done` event.
+    """
+    mission = mission_catalog.get(request.mission_id) if request.mission_id else None
+
+    async def events():
+        try:
+            async for kind, payload in stream_grading(request.code, mission, fail_fast=request.fail_fast):
+                yield sse_event(kind, payload)
+        except SandboxBusy as e:
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 # --- VISUALIZATION & AI ENGINE ---
 
-@app.post("/analyze")
-async def analyze_code(request: CodeRequest):
+async def build_visual_data(request: CodeRequest, tree=None):
+    # AST parsing is CPU work, so keep it off the event loop
     try:
-        if request.is_premium:
-            visual_data = parse_code_to_3d(request.code)
-        else:
-            visual_data = None 
+        if not request.is_premium:
+            return None
+        max_nodes = min(request.max_nodes or LOD_NODE_BUDGET, LOD_MAX_NODES)
+        graph = await run_in_threadpool(parse_code_to_3d, request.code, max_nodes, request.expand, tree)
+        if request.visual_mode == "delta":
+            # Only what changed since the graph this session last received
+            return graph_tracker.update(request.session_id, graph, request.graph_version)
+        return graph
     except Exception as e:
-        visual_data = {"error": str(e), "nodes": [], "links": []}
-    
-    ai_feedback = ""
-    if request.user_input or request.code:
-        try:
-            ai_feedback = ai_tutor.chat(request.user_input, user_code=request.code, session_id=request.session_id)
-        except Exception as e:
-            ai_feedback = f"AI Error: {str(e)}"
+        return {"error": str(e), "nodes": [], "links": []}
 
-    should_vibrate = False
-    if request.is_premium and visual_data and "error" in visual_data:
-        should_vibrate = True
+def should_vibrate(request: CodeRequest, visual_data):
+    return bool(request.is_premium and visual_data and "error" in visual_data)
 
-    return {
+def owns_session(request: CodeRequest):
+    # Clients that don't send a session_id all share the default one; never cancel each other there
+    return request.session_id != DEFAULT_SESSION
+
+def tutor_mission(request: CodeRequest):
+    # The tutor's system prompt is built (once) from the mission's description and roles
+    return mission_catalog.get(request.mission_id) if request.mission_id else None
+
+async def ask_tutor(request: CodeRequest, tree=None):
+    """
+    The tutor's reply; failures come back as an "AI Error" message, never an exception.
+    Per session, identical in-flight requests share one call and a newer request
+    cancels an older one (latest code wins).
+    """
+    if not (request.user_input or request.code):
+        return ""
+    try:
+        ai_tutor = await tutor_loader.get()
+        return await tutor_coalescer.run(
+            request.session_id, (request.user_input, request.code),
+            lambda: ai_tutor.achat(
+                request.user_input, user_code=request.code, session_id=request.session_id,
+                tree=tree, mission=tutor_mission(request),
+            ),
+            supersede=owns_session(request),
+        )
+    except Superseded:
+        return SUPERSEDED
+    except asyncio.TimeoutError:
+        return "AI Error: The tutor took too long to respond."
+    except TutorUnavailable:
+        return TUTOR_OFFLINE
+    except Exception as e:
+        return f"AI Error: {str(e)}"
+
+async def stream_tutor(request: CodeRequest, tree=None):
+    """
+    (kind, payload) events: `token` per chunk of the tutor's reply, `error` if it fails,
+    `superseded` if a newer request for the session took over.
+    """
+    if not (request.user_input or request.code):
+        return
+    try:
+        ai_tutor = await tutor_loader.get()
+        tokens = ai_tutor.astream_chat(
+            request.user_input, user_code=request.code, session_id=request.session_id,
+            tree=tree, mission=tutor_mission(request),
+        )
+        async for token in tutor_coalescer.stream(request.session_id, tokens, supersede=owns_session(request)):
+            yield "token", {"text": token}
+    except Superseded:
+        yield "superseded", {"detail": SUPERSEDED}
+    except asyncio.TimeoutError:
+        yield "error", {"detail": "AI Error: The tutor took too long to respond."}
+    except TutorUnavailable:
+        yield "error", {"detail": TUTOR_OFFLINE}
+    except Exception as e:
+        yield "error", {"detail": f"AI Error: {str(e)}"}
+
+@app.post("/analyze")
+async def analyze_code(request: CodeRequest, accept: str = Header(None)):
+    visual_data = await build_visual_data(request)
+    ai_feedback = await ask_tutor(request)
+
+    result = {
         "visual_data": visual_data,
         "ai_feedback": ai_feedback,
-        "haptic_feedback": should_vibrate,
+        "haptic_feedback": should_vibrate(request, visual_data),
         "premium_locked": not request.is_premium
     }
 
-@app.get("/missions")
-def get_missions(is_premium: bool = False):
-    file_path = os.path.join("app", "data", "missions.json")
+    # Default stays the plain node/link dicts; compact encodings are opt-in via Accept
+    wire_format = negotiate_format(accept)
+    if wire_format == "json":
+        return result
+
+    result["visual_data"] = encode_columnar(visual_data)
+    headers = {"Vary": "Accept"}
+    if wire_format == "msgpack":
+        return Response(content=dumps_msgpack(result), media_type="application/msgpack", headers=headers)
+    return Response(content=dumps_json(result), media_type=COLUMNAR_MEDIA_TYPE, headers=headers)
+
+@app.post("/analyze/stream")
+async def analyze_code_stream(request: CodeRequest):
+    """
+    Server-Sent Events version of /analyze:
+    a `visual` event first, then `token` events as the tutor writes, then `done`.
+    """
+    async def events():
+        visual_data = await build_visual_data(request)
+        yield sse_event("visual", {
+            "visual_data": visual_data,
+            "haptic_feedback": should_vibrate(request, visual_data),
+            "premium_locked": not request.is_premium
+        })
+
+        parts = []
+        async for kind, payload in stream_tutor(request):
+            if kind == "token":
+                parts.append(payload["text"])
+            yield sse_event(kind, payload)
+
+        yield sse_event("done", {"ai_feedback": "".join(parts)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# --- SUBMIT PIPELINE (run + grade + save + analyze in one request) ---
+
+def all_tests_passed(result):
+    tests = result.get("test_results")
+    return bool(result.get("success") and tests and all(t["passed"] for t in tests))
+
+async def save_if_passed(db: AsyncSession, request: CodeRequest, result):
+    if request.user_id and request.mission_id and all_tests_passed(result):
+        await upsert_progress(db, request.user_id, request.mission_id, request.code)
+        return True
+    return False
+
+def prepare_request(request: CodeRequest):
+    """(tree, job, early result): code rejected by the pre-flight skips the sandbox and becomes the grading result."""
+    mission = mission_catalog.get(request.mission_id) if request.mission_id else None
     try:
-        with open(file_path, "r") as f:
-            data = json.load(f)
-        
-        all_missions = []
-        if isinstance(data, dict):
-            for category in data:
-                items = data[category] if isinstance(data[category], list) else []
-                for m in items:
-                    if isinstance(m, dict):
-                        m['category_tag'] = category 
-                        all_missions.append(m)
-        elif isinstance(data, list):
-            all_missions = data
-
-        if is_premium:
-            return all_missions 
-        else:
-            return [m for m in all_missions if m.get('difficulty') == 'Easy']
-            
-    except Exception as e:
-        print(f"Error loading missions: {e}")
-        return []
\ No newline at end of file
+        tree, job = prepare_submission(request.code, mission, fail_fast=request.fail_fast)
+        return tree, job, None
+    except PreflightError as e:
+        return None, None, {"success": False, "output": str(e)}
+
+def tutor_request(request: CodeRequest, result):
+    """
+    The request the tutor should answer once grading is done, or None to skip it:
+    a fully passing run needs no review, and a failing one asks about its first failing case.
+    """
+    if not request.analyze or all_tests_passed(result):
+        return None
+    failed = next((t for t in result.get("test_results") or () if not t["passed"]), None)
+    if failed is None:
+        return request
+    # Ahead of the user's text: a pasted mission block runs to the end of user_input
+    note = (f"My code failed on input {failed.get('input')}. "
+            f"Expected {failed.get('expected')} but got {failed.get('actual')}. Help me fix it.")
+    user_input = f"{note}\n\n{request.user_input}" if request.user_input else note
+    return request.model_copy(update={"user_input": user_input})
+
+def submit_result(request: CodeRequest, result, progress_saved, visual_data, ai_feedback):
+    response = grading_response(result)
+    response.update({
+        "passed": all_tests_passed(result),
+        "progress_saved": progress_saved,
+        "visual_data": visual_data,
+        "ai_feedback": ai_feedback,
+        "haptic_feedback": should_vibrate(request, visual_data),
+        "premium_locked": not request.is_premium
+    })
+    return response
+
+@app.post("/submit")
+async def submit_code(request: CodeRequest, db: AsyncSession = Depends(get_db),
+                      session_uid: int = Depends(session_user_id)):
+    """
+    /execute + /save-progress + /analyze in one request.
+    The code is parsed once; the 3D graph is built while grading and then the tutor run,
+    and the tutor only gets asked (about the first failing case) when a test failed.
+    Progress is saved when every test passes, for the user of the request's session token.
+    """
+    if request.user_id is not None:
+        require_user(session_uid, request.user_id)
+    tree, job, result = prepare_request(request)
+    visual = asyncio.create_task(build_visual_data(request, tree))
+    tutor = None
+    try:
+        if job is not None:
+            result = await run_grading(job)
+        # Grading takes milliseconds next to the tutor, and decides what (if anything) to ask it
+        asked = tutor_request(request, result)
+        tutor = asyncio.create_task(ask_tutor(asked, tree)) if asked else None
+        progress_saved = await save_if_passed(db, request, result)
+        visual_data = await visual
+        ai_feedback = await tutor if tutor else ""
+    except SandboxBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    finally:
+        for task in (visual, tutor):
+            if task and not task.done():
+                task.cancel()
+
+    return submit_result(request, result, progress_saved, visual_data, ai_feedback)
+
+async def merge_streams(*streams):
+    """Interleaves several async generators of events in arrival order."""
+    queue = asyncio.Queue()
+    finished = object()
+
+    async def pump(stream):
+        try:
+            async for item in stream:
+                await queue.put(item)
+        finally:
+            await queue.put(finished)
+
+    tasks = [asyncio.create_task(pump(stream)) for stream in streams]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await queue.get()
+            if item is finished:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.post("/submit/stream")
+async def submit_code_stream(request: CodeRequest, session_uid: int = Depends(session_user_id)):
+    """
+    Server-Sent Events version of /submit. Events arrive as each stage produces them:
+    `output` / `case` from the sandbox, `graded` once tests finish (and progress is saved),
+    `visual`, `token` / `error` from the tutor (after grading, only when a test failed),
+    and finally `done` with the combined result.
+    """
+    if request.user_id is not None:
+        require_user(session_uid, request.user_id)
+    tree, job, early_result = prepare_request(request)
+    state = {"result": early_result, "progress_saved": False, "visual_data": None, "ai_feedback": []}
+    graded_event = asyncio.Event()
+
+    async def grading():
+        result = state["result"]
+        try:
+            if job is not None:
+                try:
+                    async for kind, payload in stream_job(job):
+                        if kind == "done":
+                            result = payload
+                        else:
+                            yield kind, payload
+                except SandboxBusy as e:
+                    result = {"success": False, "output": str(e)}
+        finally:
+            # Released even if grading dies, so the tutor never waits forever
+            state["result"] = result
+            graded_event.set()
+        # The request's DB session is gone once streaming starts, so open one here
+        async with SessionLocal() as db:
+            state["progress_saved"] = await save_if_passed(db, request, result)
+        graded = grading_response(result)
+        graded.update(passed=all_tests_passed(result), progress_saved=state["progress_saved"])
+        yield "graded", graded
+
+    async def visual():
+        visual_data = state["visual_data"] = await build_visual_data(request, tree)
+        yield "visual", {
+            "visual_data": visual_data,
+            "haptic_feedback": should_vibrate(request, visual_data),
+            "premium_locked": not request.is_premium
+        }
+
+    async def tutor():
+        if not request.analyze:
+            return
+        await graded_event.wait()
+        asked = tutor_request(request, state["result"]) if state["result"] else None
+        if asked is None:
+            return
+        async for kind, payload in stream_tutor(asked, tree):
+            if kind == "token":
+                state["ai_feedback"].append(payload["text"])
+            yield kind, payload
+
+    async def events():
+        async for kind, payload in merge_streams(grading(), visual(), tutor()):
+            yield sse_event(kind, payload)
+        yield sse_event("done", submit_result(
+            request, state["result"], state["progress_saved"],
+            state["visual_data"], "".join(state["ai_feedback"])
+        ))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint for this worker process."""
+    return Response(content=registry.render(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+@app.get("/tutor/cache-stats")
+def tutor_cache_stats():
+    ai_tutor = tutor_loader.peek()
+    if ai_tutor is None:
+        raise HTTPException(status_code=503, detail=f"AI tutor is {tutor_loader.state}.")
+    return ai_tutor.cache.stats()
+
+@app.get("/missions")
+def get_missions(is_premium: bool = False, if_none_match: str = Header(None)):
+    body, etag = mission_catalog.rendered(is_premium)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    # Polling clients send back the ETag they have; skip the body if nothing changed
+    if if_none_match:
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,75 @@
+import pytest
+
+from app.engine.executor import build_job
+from app.engine.preflight import preflight, PreflightError
+
+
+def assert_forbidden(code):
+    with pytest.raises(PreflightError) as info:
+        preflight(code)
+    assert info.value.kind == "forbidden"
+
+
+def test_computed_getattr_escape_is_rejected():
+    # Walks () -> object -> os._wrap_close -> os.popen with names built at runtime
+    assert_forbidden(
+        'g=getattr\n'
+        'c=g((),"__cl"+"ass__")\n'
+        'b=g(c,"__ba"+"se__")\n'
+        'for s in g(b,"__subcl"+"asses__")():\n'
+        '    if s.__name__ == "_wrap_close":\n'
+        '        g(g(s,"__init__"),"__glo"+"bals__")["popen"]("id")\n'
+    )
+
+
+def test_chained_format_field_escape_is_rejected():
+    # Only the last attribute of a field used to be checked; this one printed the worker's os.environ
+    assert_forbidden('import random\nprint("{0.__init__.__globals__[_os].environ}".format(random.Random()))')
+
+
+@pytest.mark.parametrize("code", [
+    'getattr((), "__cl" + "ass__")',
+    'name = "__class__"\nhasattr((), name)',
+    'getattr((), "__class__")',
+    'f = getattr',
+    'print(list(map(getattr, [()], ["__class__"])))',
+    'import random\nrandom._os',
+    'x = ().__class__',
+    'from operator import attrgetter',
+    'import operator\noperator.attrgetter("__class__")',
+    'fmt = "{0.__cl" + "ass__}"\nprint(fmt.format(1))',
+    'print("{0.__class__}".format(1))',
+    'print("{0.real.__class__}".format(1))',
+    'print("{0[}].__class__}".format({"}": 1}))',
+    'import os',
+    'print(open("x"))',
+    '__builtins__',
+])
+def test_escapes_are_rejected(code):
+    assert_forbidden(code)
+
+
+@pytest.mark.parametrize("code", [
+    '# import os\nprint("open(")',
+    'print(getattr([], "append"))',
+    'class A:\n    def __init__(self):\n        super().__init__()\n        self.total = 0\n',
+    'import math\nprint("{:.2f} {}".format(math.pi, type(1).__name__))',
+    'if __name__ == "__main__":\n    print(f"{1 + 1}")',
+])
+def test_ordinary_code_passes(code):
+    preflight(code)
+
+
+def test_syntax_errors_are_reported_as_such():
+    with pytest.raises(PreflightError) as info:
+        preflight("def f(:\n")
+    assert info.value.kind == "syntax"
+
+
+@pytest.mark.parametrize("terms", [1500, 50000])
+def test_deeply_nested_code_is_a_syntax_error(terms):
+    # Deep enough to exhaust the parser's stack (50k) or only the compiler's (1.5k)
+    code = "x = " + "+".join(["1"] * terms)
+    with pytest.raises(PreflightError) as info:
+        build_job(code, tree=preflight(code))
+    assert info.value.kind == "syntax"
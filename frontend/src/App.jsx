@@ -1,19 +1,37 @@
 import React, { useState, useEffect } from 'react';
+import axios from 'axios';
 import Dashboard from './components/Dashboard';
 import MissionSelect from './components/MissionSelect';
 import LoginModal from './components/LoginModal';
 
 function App() {
-  const [user, setUser] = useState(null); // { id, username, is_premium }
+  const [user, setUser] = useState(null); // { id, username, is_premium, token }
   const [currentScreen, setCurrentScreen] = useState('menu'); 
   const [activeMission, setActiveMission] = useState(null);
 
-  // Check LocalStorage on load
+  // Check LocalStorage on load; the saved token is checked with the server before it is used
   useEffect(() => {
     const savedUser = localStorage.getItem('deepblue_user');
-    if (savedUser) {
-      setUser(JSON.parse(savedUser));
+    if (!savedUser) return;
+    const parsed = JSON.parse(savedUser);
+    if (!parsed.token) {
+      localStorage.removeItem('deepblue_user'); // Saved before tokens existed; log in again
+      return;
     }
+    axios.get('http://127.0.0.1:8000/session', { headers: { Authorization: `Bearer ${parsed.token}` } })
+      .then((response) => {
+        const resumed = { ...parsed, id: response.data.user_id, is_premium: response.data.is_premium };
+        setUser(resumed);
+        localStorage.setItem('deepblue_user', JSON.stringify(resumed));
+      })
+      .catch((err) => {
+        // Expired or forged tokens need a fresh login; keep the user if the server is just unreachable
+        if (err.response && err.response.status === 401) {
+          localStorage.removeItem('deepblue_user');
+        } else {
+          setUser(parsed);
+        }
+      });
   }, []);
 
   const handleLogin = (userData) => {
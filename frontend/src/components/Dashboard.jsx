@@ -29,6 +29,11 @@ const Dashboard = ({ user, initialCode, missionId, missionDesc, onBack, onUpgrad
   // Extract User Info
   const isPremium = user?.is_premium || false;
   const userId = user?.id;
+  // The server only saves progress or upgrades for the user whose session token comes along
+  const authConfig = { headers: user?.token ? { Authorization: `Bearer ${user.token}` } : {} };
+
+  // Own tutor session per editor, so rapid re-runs replace each other instead of other users' requests
+  const sessionId = useRef(`${userId || "guest"}-${Math.random().toString(36).slice(2, 10)}`).current;
 
   const textareaRef = useRef(null);
   const messagesEndRef = useRef(null); // Ref for auto-scrolling
@@ -62,38 +67,44 @@ const Dashboard = ({ user, initialCode, missionId, missionDesc, onBack, onUpgrad
     }
   };
 
-  // 3. RUN & TEST ENGINE (Calls /execute)
+  // 3. RUN & TEST ENGINE (Calls /submit: run, grade, save progress and ask the AI in one request)
   const handleRun = async () => {
       setLoading(true);
       setOutput("Running...");
       setTestResults(null);
+      setAiFeedback("Deep Blue is thinking...");
       try {
-          const response = await axios.post('http://127.0.0.1:8000/execute', { 
+          const response = await axios.post('http://127.0.0.1:8000/submit', { 
               code, 
-              mission_id: missionId 
-          });
-          setOutput(response.data.output || "No output.");
+              mission_id: missionId,
+              user_id: userId,
+              user_input: "Review my solution for this mission.",
+              session_id: sessionId,
+              is_premium: isPremium
+          }, authConfig);
+          const data = response.data;
+          setOutput(data.output || "No output.");
           
-          if (response.data.test_results) {
-              setTestResults(response.data.test_results);
+          if (data.test_results) {
+              setTestResults(data.test_results);
               setActiveTab("tests");
+          }
 
-              // If all tests pass, save progress!
-              const allPassed = response.data.test_results.every(t => t.passed);
-              if (allPassed && userId && missionId) {
-                  // Call the Save Endpoint
-                  await axios.post(`http://127.0.0.1:8000/save-progress?user_id=${userId}&mission_id=${missionId}&code=${encodeURIComponent(code)}`);
-                  setOutput(prev => prev + "\n\n✨ MISSION COMPLETE! Progress Saved to Database.");
-              }
-              
-              // If any failed, ask AI automatically
-              const failed = response.data.test_results.find(t => !t.passed);
-              if(failed) {
-                 handleAnalyze(`My code failed on input ${failed.input}. Expected ${failed.expected} but got ${failed.actual}. Help me fix it.`);
-              }
+          // Saved by the server when every test passed
+          if (data.progress_saved) {
+              setOutput(prev => prev + "\n\n✨ MISSION COMPLETE! Progress Saved to Database.");
           }
+
+          if (data.visual_data) setVisualData(data.visual_data);
+          // The server only asks the tutor when a test failed, about the first failing case
+          setAiFeedback(data.ai_feedback || "Ready to analyze...");
+          if (data.haptic_feedback && navigator.vibrate) navigator.vibrate(200);
       } catch (error) {
-          setOutput("Error: Execution failed.");
+          if (error.response && error.response.status === 401) {
+              setOutput("Error: Your session has expired. Please log out and log in again.");
+          } else {
+              setOutput("Error: Execution failed.");
+          }
       }
       setLoading(false);
   };
@@ -106,7 +117,9 @@ const Dashboard = ({ user, initialCode, missionId, missionDesc, onBack, onUpgrad
     try {
       const response = await axios.post('http://127.0.0.1:8000/analyze', {
         code: code,
+        mission_id: missionId,
         user_input: customPrompt || "Analyze this logic",
+        session_id: sessionId,
         is_premium: isPremium 
       });
       setVisualData(response.data.visual_data);
@@ -130,7 +143,7 @@ const Dashboard = ({ user, initialCode, missionId, missionDesc, onBack, onUpgrad
       setUpgrading(true);
       try {
           // Sending user_id as a query parameter as expected by the backend
-          const response = await axios.post(`http://127.0.0.1:8000/upgrade-premium?user_id=${userId}`);
+          const response = await axios.post(`http://127.0.0.1:8000/upgrade-premium?user_id=${userId}`, null, authConfig);
           
           console.log("Upgrade Response:", response.data); // DEBUG LOG
 
@@ -28,7 +28,8 @@ const LoginModal = ({ onLogin }) => {
       onLogin({
         id: response.data.user_id,
         username: username,
-        is_premium: response.data.is_premium
+        is_premium: response.data.is_premium,
+        token: response.data.token // Signed session token (lets the server skip password checks)
       });
     } catch (err) {
       console.error(err);